@@ -0,0 +1,85 @@
+import os
+import json
+import random
+import shutil
+
+# realistic shapes for a Blinkist book: most have 8 to 12 blinks of a few
+# kilobytes of html each, and about a third of them have a supplement
+CHAPTERS_RANGE = (6, 14)
+PARAGRAPHS_RANGE = (6, 18)
+SUPPLEMENT_RATIO = 0.3
+CATEGORIES = [
+    "Entrepreneurship", "Marketing & Sales", "Science", "Psychology",
+    "Productivity", "History", "Health & Nutrition", "Money & Investments",
+]
+WORDS = (
+    "the a of to and in that is for it as with was on be by this are "
+    "habit mind work people time life world change idea book author growth "
+    "success business brain science money health focus decision leader team"
+).split()
+
+TEMPLATES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+def make_paragraphs(rng, count):
+    paragraphs = []
+    for _ in range(count):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(
+            40, 90)))
+        paragraphs.append(f"<p>{sentence.capitalize()}.</p>")
+    return "".join(paragraphs)
+
+
+def make_book(rng, index):
+    slug = f"synthetic-book-{index}-en"
+    chapters = []
+    for order_no in range(1, rng.randint(*CHAPTERS_RANGE) + 1):
+        chapters.append({
+            "id": f"{index:06d}{order_no:03d}",
+            "order_no": order_no,
+            "title": f"Blink {order_no} of synthetic book {index}",
+            "content": make_paragraphs(rng, rng.randint(*PARAGRAPHS_RANGE)),
+            "supplement": (
+                make_paragraphs(rng, 2)
+                if rng.random() < SUPPLEMENT_RATIO else None
+            ),
+        })
+    return {
+        "id": f"{index:06d}",
+        "slug": slug,
+        "title": f"Synthetic Book {index}",
+        "author": f"Author {index % 97}",
+        "language": "en",
+        "is_audio": True,
+        "category": rng.choice(CATEGORIES),
+        "about_the_book": make_paragraphs(rng, 1),
+        "about_the_author": make_paragraphs(rng, 1),
+        "who_should_read": make_paragraphs(rng, 1),
+        "image_url": f"https://images.example.com/{slug}/3_4/640.jpg",
+        "images": {
+            "url_template":
+                f"https://images.example.com/{slug}/%type%/%size%.jpg"
+        },
+        "main_color": "f5f1ea",
+        "text_color": "03314b",
+        "chapters": chapters,
+    }
+
+
+def build_corpus(workdir, size, seed=0):
+    """
+    Creates a working directory with 'size' synthetic books in its dump
+    folder, and a copy of the templates, as the scraper would leave it.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(os.path.join(workdir, "dump"))
+    shutil.copytree(TEMPLATES_DIR, os.path.join(workdir, "templates"))
+    for index in range(size):
+        book = make_book(rng, index)
+        dump_file = os.path.join(workdir, "dump", book["slug"] + ".json")
+        with open(dump_file, "w") as outfile:
+            json.dump(book, outfile, indent=4)
+    return workdir
@@ -0,0 +1,366 @@
+"""
+A local stand-in for the Blinkist website, API, audio endpoint and audio
+files server, serving synthetic books with the markup the scraper expects.
+
+usage: python benchmarks/fakeserver.py [--port 8000] [--books 1000]
+                                       [--latency 0.05] [--error-rate 0.01]
+
+then scrape it with e.g.:
+
+    python blinkistscraper --headless --no-ublock \\
+        --base-url http://127.0.0.1:8000 any@email.com any-password
+
+Any email and password log in. The error rate only applies to the API,
+audio and audio files requests (which the scraper retries or reports), as
+an error page in the browser would stall it until its timeouts.
+"""
+import re
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import functools
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import corpus
+
+SESSION_COOKIE = "fake_session"
+
+
+def get_category_slug(label):
+    return re.sub(r"[^a-z0-9]+", "-", label.lower()).strip("-")
+
+
+class FakeBlinkist:
+    """
+    The books served by the stand-in site, generated on demand from their
+    index so that large catalogs don't have to be kept in memory.
+
+    books -- number of books in the catalog.
+    latency -- seconds to wait before answering each request (on average).
+    error_rate -- ratio of API and audio requests answered with a 429 (with
+                  a Retry-After header) or a 503.
+    audio_size -- size in bytes of each audio blink file.
+    """
+
+    def __init__(
+        self, books=100, latency=0.0, error_rate=0.0, audio_size=64 * 1024,
+        seed=0
+    ):
+        self.books = books
+        self.latency = latency
+        self.error_rate = error_rate
+        self.audio_size = audio_size
+        self.seed = seed
+        self.categories = {
+            get_category_slug(label): label for label in corpus.CATEGORIES
+        }
+
+    @functools.lru_cache(maxsize=256)
+    def get_book(self, index):
+        book = corpus.make_book(random.Random(self.seed * 1000003 + index),
+                                index)
+        # the scraper adds the category itself, from the listing it used
+        del book["category"]
+        return book
+
+    def get_book_index(self, slug):
+        match = re.fullmatch(r"synthetic-book-(\d+)-en", slug)
+        if not match or int(match.group(1)) >= self.books:
+            return None
+        return int(match.group(1))
+
+    def get_book_category(self, index):
+        # every tenth book is only listed in the sitemap, as uncategorized
+        if index % 10 == 9:
+            return None
+        return corpus.CATEGORIES[index % len(corpus.CATEGORIES)]
+
+    def get_book_slugs(self, category=None):
+        for index in range(self.books):
+            if category is None or self.get_book_category(index) == category:
+                yield f"synthetic-book-{index}-en"
+
+
+def page(title, body):
+    return (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{escape(title)}</title></head><body>"
+        f"<header><a class='header__logo' href='/'>Blinkist</a></header>"
+        f"{body}</body></html>"
+    )
+
+
+class FakeBlinkistHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # (method, path pattern, handler name, can fail)
+    ROUTES = [
+        ("GET", r"/(\w+)/nc/login", "login_page", False),
+        ("POST", r"/(\w+)/nc/login", "login", False),
+        ("GET", r"/(\w+)/nc/library", "library_page", False),
+        ("GET", r"/(\w+)/categories/([\w-]+)/books", "category_page", False),
+        ("GET", r"/(\w+)/sitemap", "sitemap_page", False),
+        ("GET", r"/(\w+)/nc/daily", "daily_page", False),
+        ("GET", r"/(\w+)/nc/reader/([\w-]+)", "reader_page", False),
+        ("GET", r"/v4/books/(\d+)", "book_api", True),
+        ("GET", r"/api/books/(\d+)/chapters/(\d+)/audio", "audio_api", True),
+        ("GET", r"/cdn/(\d+)/(\d+)\.m4a", "audio_file", True),
+        ("GET", r"/images/([\w-]+)/(\w+)/(\d+)\.jpg", "cover_image", False),
+    ]
+
+    @property
+    def site(self):
+        return self.server.site
+
+    @property
+    def base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        # read the form data, the credentials are never checked
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.route("POST")
+
+    def route(self, method):
+        path = self.path.split("?")[0]
+        for route_method, pattern, name, can_fail in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method != method or not match:
+                continue
+            if self.site.latency:
+                time.sleep(self.site.latency * random.uniform(0.5, 1.5))
+            if can_fail and random.random() < self.site.error_rate:
+                # as many rate limiting answers as server errors
+                if random.random() < 0.5:
+                    return self.send(429, b"Too Many Requests", "text/plain",
+                                     {"Retry-After": "1"})
+                return self.send(503, b"Service Unavailable", "text/plain")
+            return getattr(self, name)(*match.groups())
+        self.send(404, b"Not Found", "text/plain")
+
+    def send(self, status, content, content_type, headers={}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def send_html(self, html, headers={}):
+        self.send(200, html.encode("utf-8"), "text/html; charset=utf-8",
+                  headers)
+
+    def redirect(self, path, headers={}):
+        headers = dict(headers, Location=self.base_url + path)
+        self.send(302, b"", "text/plain", headers)
+
+    def is_logged_in(self):
+        return f"{SESSION_COOKIE}=" in (self.headers.get("Cookie") or "")
+
+    def login_page(self, language):
+        if self.is_logged_in():
+            return self.redirect(f"/{language}/nc/library")
+        self.send_html(page("Log in", f"""
+            <form method="post" action="/{language}/nc/login">
+              <input id="login-form_login_email" name="email">
+              <input id="login-form_login_password" name="password"
+                     type="password">
+              <button type="submit" name="commit">Log in</button>
+            </form>
+        """))
+
+    def login(self, language):
+        self.redirect(f"/{language}/nc/library", {
+            "Set-Cookie": f"{SESSION_COOKIE}=1; Path=/; Max-Age=86400"
+        })
+
+    def library_page(self, language):
+        if not self.is_logged_in():
+            return self.redirect(f"/{language}/nc/login")
+        categories = "".join(
+            f"<li><a href='/{language}/categories/{slug}'>"
+            f"<span>{escape(label)}</span></a></li>"
+            for slug, label in self.site.categories.items()
+        )
+        self.send_html(page("Library", f"""
+            <h1 class="main-banner-headline-v2">Your library</h1>
+            <button class="header-menu__trigger">Explore</button>
+            <ul class="discover-menu__categories">{categories}</ul>
+        """))
+
+    def category_page(self, language, category_slug):
+        label = self.site.categories.get(category_slug)
+        if not label:
+            return self.send(404, b"Not Found", "text/plain")
+        links = "".join(
+            f"<a class='letter-book-list__item' href='/{language}/books/{slug}'"
+            f">{slug}</a>"
+            for slug in self.site.get_book_slugs(label)
+        )
+        self.send_html(page(label, f"<div>{links}</div>"))
+
+    def sitemap_page(self, language):
+        links = "".join(
+            f"<li><a href='/en/books/{slug}'>{slug}</a></li>"
+            for slug in self.site.get_book_slugs()
+        )
+        self.send_html(page("Sitemap", f"""
+            <div class="sitemap__section sitemap__section--books">
+              <ul>{links}</ul>
+            </div>
+        """))
+
+    def daily_page(self, language):
+        self.send_html(page("Free daily", f"""
+            <div class="daily-book__infos">
+              <a href="/{language}/books/synthetic-book-0-en">Daily book</a>
+            </div>
+        """))
+
+    def reader_page(self, language, slug):
+        if not self.is_logged_in():
+            return self.redirect(f"/{language}/nc/login")
+        index = self.site.get_book_index(slug)
+        if index is None:
+            return self.send(404, b"Not Found", "text/plain")
+        book = self.site.get_book(index)
+        sections = []
+        for chapter in book["chapters"]:
+            sections.append(
+                f"<div class='chapter' data-chapterno='{chapter['order_no']}'>"
+                f"<h2>{escape(chapter['title'])}</h2>"
+                f"<div class='chapter__content'>{chapter['content']}</div>"
+                f"</div>"
+            )
+            if chapter["supplement"]:
+                sections.append(
+                    f"<div class='chapter supplement' "
+                    f"data-chapterno='{chapter['order_no']}'>"
+                    f"<div class='chapter__content'>{chapter['supplement']}"
+                    f"</div></div>"
+                )
+        # the player requests the first blink's audio, as the real one does
+        first_chapter = book["chapters"][0]
+        self.send_html(page(book["title"], f"""
+            <div class="reader__container" data-book-id="{book['id']}">
+              {''.join(sections)}
+            </div>
+            <script>
+              fetch("/api/books/{book['id']}/chapters/"
+                    + "{first_chapter['id']}/audio", {{credentials: "include"}});
+            </script>
+        """))
+
+    def book_api(self, book_id):
+        index = int(book_id)
+        if index >= self.site.books:
+            return self.send(404, b"Not Found", "text/plain")
+        book = dict(self.site.get_book(index))
+        book["chapters"] = [
+            {"id": chapter["id"], "order_no": chapter["order_no"],
+             "title": chapter["title"]}
+            for chapter in book["chapters"]
+        ]
+        book["image_url"] = f"{self.base_url}/images/{book['slug']}/3_4/640.jpg"
+        book["images"] = {
+            "url_template":
+                f"{self.base_url}/images/{book['slug']}/%type%/%size%.jpg"
+        }
+        content = json.dumps({"book": book}).encode("utf-8")
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.send(304, b"", "application/json", {"ETag": etag})
+        self.send(200, content, "application/json", {"ETag": etag})
+
+    def audio_api(self, book_id, chapter_id):
+        if not self.is_logged_in():
+            return self.send(401, b"Unauthorized", "text/plain")
+        content = json.dumps({
+            "url": f"{self.base_url}/cdn/{book_id}/{chapter_id}.m4a"
+        }).encode("utf-8")
+        # the audio endpoint answers with gzipped json, with no
+        # Content-Encoding header
+        self.send(200, gzip.compress(content), "application/json")
+
+    def audio_file(self, book_id, chapter_id):
+        size = self.site.audio_size
+        content = (chapter_id.encode("utf-8") * size)[:size]
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                return self.send(416, b"", "audio/mp4", {
+                    "Content-Range": f"bytes */{size}"})
+            return self.send(206, content[start:], "audio/mp4", {
+                "Content-Range": f"bytes {start}-{size - 1}/{size}"})
+        self.send(200, content, "audio/mp4", {"Accept-Ranges": "bytes"})
+
+    def cover_image(self, slug, type, size):
+        # not a real image, but enough bytes to stand for one
+        content = b"\xff\xd8\xff\xe0" + slug.encode("utf-8") * 64 + b"\xff\xd9"
+        self.send(200, content, "image/jpeg")
+
+
+def start(port=0, **kwargs):
+    """
+    Starts the stand-in site on a background thread, returning the server
+    and its base url. Pass port 0 to pick any free port.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeBlinkistHandler)
+    server.daemon_threads = True
+    server.site = FakeBlinkist(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a local stand-in for the Blinkist website")
+    parser.add_argument(
+        "--port", type=int, default=8000, help="The port to listen on")
+    parser.add_argument(
+        "--books", type=int, default=100,
+        help="Number of books in the catalog")
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Average seconds to wait before answering each request")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="Ratio of API, audio and audio files requests failing with 429 "
+        "or 503")
+    parser.add_argument(
+        "--audio-size", type=int, default=64 * 1024,
+        help="Size in bytes of each audio blink file")
+    args = parser.parse_args()
+
+    server, base_url = start(
+        args.port,
+        books=args.books,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        audio_size=args.audio_size,
+    )
+    print(f"Serving {args.books} books at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
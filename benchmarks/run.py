@@ -0,0 +1,230 @@
+"""
+Benchmarks the generators and the dump layer on synthetic corpora.
+
+usage: python benchmarks/run.py [--sizes 100 1000 10000] [--repeat N]
+                                [--baseline FILE] [--save-baseline]
+                                [--scrape-workers 1 4] [--chromedriver PATH]
+
+Each corpus size runs in its own process and working directory (the scraper
+works relative to the current directory), and the results are compared with
+the stored baseline. With '--scrape-workers', whole scrape runs against the
+local stand-in site (see fakeserver.py) are timed too, which needs Chrome.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "blinkistscraper")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+# slower than the baseline by more than this ratio is reported as regression
+REGRESSION_THRESHOLD = 1.2
+
+sys.path.insert(0, PACKAGE_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+def load_main_module():
+    # scraped_audio_exists lives in the package's __main__ module
+    spec = importlib.util.spec_from_file_location(
+        "blinkistscraper_main", os.path.join(PACKAGE_DIR, "__main__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(function, repeat):
+    # best time out of 'repeat' runs, each one preceded by its own setup
+    best = None
+    for _ in range(repeat):
+        setup, run = function()
+        setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scrape_benchmarks(size, repeat, scrape_workers, chromedriver, latency):
+    import fakeserver
+
+    server, base_url = fakeserver.start(books=size, latency=latency)
+    workdir = os.path.join(tempfile.gettempdir(), f"blinkist-scrape-{size}")
+
+    def clear_workdir():
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.makedirs(workdir)
+
+    def scrape(workers):
+        command = [
+            sys.executable, PACKAGE_DIR, "--headless", "--no-ublock",
+            "--no-sandbox", "--base-url", base_url, "--workers", str(workers),
+        ]
+        if chromedriver:
+            command += ["--chromedriver", chromedriver]
+        command += ["benchmark@example.com", "password"]
+        subprocess.run(command, check=True, cwd=workdir,
+                       stdout=subprocess.DEVNULL)
+
+    results = {}
+    for workers in scrape_workers:
+        results[f"scrape_{workers}_workers"] = round(timed(
+            lambda: (clear_workdir, lambda: scrape(workers)), repeat), 4)
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_benchmarks(size, repeat):
+    import corpus
+
+    workdir = os.path.join(tempfile.gettempdir(), f"blinkist-bench-{size}")
+    corpus.build_corpus(workdir, size)
+    os.chdir(workdir)
+
+    import catalog
+    import generator
+    import utils
+
+    main_module = load_main_module()
+    # the generators log every book, which would be the bulk of the timings
+    logging.getLogger("blinkistscraper").setLevel(logging.WARNING)
+    # the corpus dumps are single files, split them as the scraper would
+    catalog.convert_dumps("json")
+    dump_files = catalog.get_dump_paths()
+    books = [utils.get_or_read_json(file) for file in dump_files]
+
+    def clear_outputs():
+        shutil.rmtree("books", ignore_errors=True)
+
+    def no_scrape():
+        subprocess.run(
+            [sys.executable, PACKAGE_DIR, "--no-scrape"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+
+    benchmarks = {
+        "get_or_read_json": lambda: (
+            lambda: None,
+            lambda: [utils.get_or_read_json(file) for file in dump_files],
+        ),
+        "scraped_audio_exists": lambda: (
+            lambda: None,
+            lambda: [main_module.scraped_audio_exists(book) for book in books],
+        ),
+        "generate_book_html": lambda: (
+            clear_outputs,
+            lambda: [generator.generate_book_html(book) for book in books],
+        ),
+        "generate_book_epub": lambda: (
+            clear_outputs,
+            lambda: [generator.generate_book_epub(book) for book in books],
+        ),
+        # every output missing, then every output up to date
+        "no_scrape_cold": lambda: (clear_outputs, no_scrape),
+        "no_scrape_warm": lambda: (lambda: None, no_scrape),
+    }
+    results = {}
+    for name, benchmark in benchmarks.items():
+        results[name] = round(timed(benchmark, repeat), 4)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    print(f"{'size':>6} {'benchmark':<22} {'seconds':>9} {'per book':>10} "
+          f"{'baseline':>9} {'ratio':>6}")
+    regressions = 0
+    for size, size_results in results.items():
+        for name, seconds in size_results.items():
+            line = (f"{size:>6} {name:<22} {seconds:>9.3f} "
+                    f"{seconds / int(size) * 1000:>8.3f}ms")
+            baseline_seconds = baseline.get(size, {}).get(name)
+            if baseline_seconds:
+                ratio = seconds / baseline_seconds
+                line += f" {baseline_seconds:>9.3f} {ratio:>6.2f}"
+                if ratio > REGRESSION_THRESHOLD:
+                    line += "  slower"
+                    regressions += 1
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the generators and the dump layer")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000],
+        help="Number of books in each synthetic corpus")
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        help="Runs of each benchmark, the best one is kept")
+    parser.add_argument(
+        "--baseline", default=DEFAULT_BASELINE,
+        help="The baseline results file to compare with")
+    parser.add_argument(
+        "--save-baseline", action="store_true", default=False,
+        help="Store these results as the new baseline")
+    parser.add_argument(
+        "--scrape-workers", type=int, nargs="+", default=[],
+        help="Also time scraping the whole stand-in site with each of these "
+        "numbers of browsers (needs Chrome)")
+    parser.add_argument(
+        "--chromedriver",
+        help="Path to the chromedriver executable to scrape with")
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Average seconds the stand-in site waits before each answer")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        # run for a single size, in a process of its own
+        results = run_benchmarks(args.size, args.repeat)
+        if args.scrape_workers:
+            results.update(scrape_benchmarks(
+                args.size, args.repeat, args.scrape_workers,
+                args.chromedriver, args.latency))
+        print(json.dumps(results))
+        return
+
+    results = {}
+    for size in args.sizes:
+        command = [
+            sys.executable, os.path.abspath(__file__), "--size", str(size),
+            "--repeat", str(args.repeat), "--latency", str(args.latency),
+        ]
+        if args.scrape_workers:
+            command += ["--scrape-workers"] + [
+                str(workers) for workers in args.scrape_workers]
+        if args.chromedriver:
+            command += ["--chromedriver", args.chromedriver]
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE).stdout
+        results[str(size)] = json.loads(output.decode("utf-8").splitlines()[-1])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as outfile:
+            json.dump(baseline, outfile, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,30 @@
 import argparse
 import sys
 import os
-import glob
+import queue
 import time
 
+import catalog
+import covers
+import dumps
+import httpclient
 import scraper
 import generator
+import journal
+import listings
 import logger
+import metrics
+import pipeline
+import workers
+from utils import get_book_pretty_filepath
+from utils import get_book_slug
 
 log = logger.get("blinkistscraper")
 
+# how many times the audio of a book is retried when the audio endpoint
+# rejects the request headers
+AUDIO_RETRIES = 2
+
 
 def scraped_audio_exists(book_json):
     from utils import get_book_pretty_filepath, get_book_pretty_filename
@@ -17,6 +32,13 @@ def scraped_audio_exists(book_json):
     filepath = get_book_pretty_filepath(book_json)
     concat_audio = os.path.join(
         filepath, get_book_pretty_filename(book_json, ".m4a"))
+    if catalog.get_audio_status(book_json["slug"]) == "combined":
+        if os.path.exists(concat_audio):
+            log.debug("Concatenated audio already exists")
+            return True
+        # the concatenated audio was deleted since: download it again
+        log.debug("Concatenated audio is missing, downloading it again")
+        catalog.set_audio_status(book_json["slug"], None)
     existing_audio_files = []
     chapters = book_json["chapters"]
     chapter_count = len(chapters)
@@ -26,6 +48,8 @@ def scraped_audio_exists(book_json):
         chapter_data = chapter[1]
         chapter_audio_filename = str(chapter_data["order_no"]) + ".m4a"
         chapter_audio_path = os.path.join(filepath, chapter_audio_filename)
+        # audio files are only renamed to their final name once completely
+        # downloaded (interrupted downloads are left as .part files)
         chapter_audio_exists = os.path.exists(chapter_audio_path)
         if chapter_audio_exists:
             existing_audio_files.append(chapter_audio_path)
@@ -76,8 +100,38 @@ def main():
         "--cooldown",
         type=check_cooldown,
         default=1,
-        help="Seconds to wait between scraping books, and downloading audio "
-        "files. Can't be smaller than 1"
+        help="Seconds to wait between requests to the website at first. The "
+        "delay then adapts to how the website responds: it shortens while "
+        "responses are healthy, down to '--min-cooldown', and lengthens "
+        "sharply on errors, slow responses, challenges or captchas. Can't be "
+        "smaller than 1"
+    )
+
+    def check_min_cooldown(value):
+        if float(value) <= 0:
+            raise argparse.ArgumentTypeError("Must be greater than 0")
+        return float(value)
+
+    parser.add_argument(
+        "--min-cooldown",
+        type=check_min_cooldown,
+        default=0.25,
+        help="The shortest delay in seconds between requests to the website, "
+        "however well it responds"
+    )
+
+    def check_workers(value):
+        if int(value) < 1:
+            raise argparse.ArgumentTypeError("Can't be smaller than 1")
+        return int(value)
+
+    parser.add_argument(
+        "--workers",
+        type=check_workers,
+        default=1,
+        help="Number of browsers scraping books in parallel. The extra "
+        "browsers log in with the cookies stored by the first one, and they "
+        "all share the same (adaptive) cooldown"
     )
     parser.add_argument(
         "--headless",
@@ -92,6 +146,13 @@ def main():
         default=False,
         help="Download the audio blinks for each book"
     )
+    parser.add_argument(
+        "--audio-workers",
+        type=check_workers,
+        default=4,
+        help="Number of audio blinks downloaded in parallel for each book. "
+        "Requests are still rate-limited (works with '--audio' only)"
+    )
     parser.add_argument(
         "--concat-audio",
         action="store_true",
@@ -99,6 +160,13 @@ def main():
         help="Concatenate the audio blinks into a single file and tag it. "
         "Requires ffmpeg"
     )
+    parser.add_argument(
+        "--ffmpeg-jobs",
+        type=check_workers,
+        default=2,
+        help="Maximum number of ffmpeg processes combining audio files in the "
+        "background while scraping (works with '--concat-audio' only)"
+    )
     parser.add_argument(
         "--keep-noncat",
         action="store_true",
@@ -113,6 +181,72 @@ def main():
         help="Don't scrape the website, only process existing json files in "
         "the dump folder. Do not provide email or password with this option."
     )
+
+    def check_jobs(value):
+        if int(value) < 0:
+            raise argparse.ArgumentTypeError("Can't be smaller than 0")
+        return int(value)
+
+    parser.add_argument(
+        "--rebuild-stale",
+        action="store_true",
+        default=False,
+        help="Like '--no-scrape', but only process the json files whose "
+        "output files are missing, or were generated from a different json "
+        "file or templates"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=check_jobs,
+        default=1,
+        help="Number of processes generating the output files (or converting "
+        "the dumps) in parallel, or 0 to use all the cores (works with "
+        "'--no-scrape', '--rebuild-stale' and '--migrate-dumps' only)"
+    )
+    parser.add_argument(
+        "--dump-format",
+        choices=dumps.FORMATS.keys(),
+        default="json",
+        help="The format new json dumps are stored in: plain, gzip or zstd "
+        "compressed (json.zst needs the 'zstandard' package). Dumps in every "
+        "format are read regardless"
+    )
+    parser.add_argument(
+        "--migrate-dumps",
+        choices=dumps.FORMATS.keys(),
+        metavar="FORMAT",
+        help="Don't scrape the website, only convert the existing json dumps "
+        "to FORMAT (json, json.gz or json.zst), splitting the single-file "
+        "ones. Do not provide email or password with this option."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue the last scrape run exactly where it stopped, using "
+        "its journal: the categories and books already listed are not "
+        "listed again, and the books already done are skipped"
+    )
+
+    def check_listings_ttl(value):
+        if float(value) < 0:
+            raise argparse.ArgumentTypeError("Can't be smaller than 0")
+        return float(value)
+
+    parser.add_argument(
+        "--listings-ttl",
+        type=check_listings_ttl,
+        default=listings.DEFAULT_TTL / 3600,
+        help="Hours the lists of categories, and of the books in each "
+        "category, are reused for before being listed again (24 by default)"
+    )
+    parser.add_argument(
+        "--refresh-listings",
+        action="store_true",
+        default=False,
+        help="List the categories, and the books in each category, again "
+        "instead of reusing the cached lists"
+    )
     parser.add_argument(
         "--book",
         default=False,
@@ -215,11 +349,32 @@ def main():
         "'--no-sandbox' argument",
     )
 
+    parser.add_argument(
+        "--metrics-file",
+        default=metrics.PROMETHEUS_FILE,
+        help="Where to write the run's metrics as a Prometheus textfile (a "
+        "json report is also written in the 'metrics' folder)"
+    )
+    parser.add_argument(
+        "--base-url",
+        help="Scrape the Blinkist website at this URL instead, e.g. a local "
+        "stand-in server (see 'benchmarks/fakeserver.py')"
+    )
+    parser.add_argument(
+        "--api-url",
+        help="Fetch the books' metadata from the Blinkist API at this URL "
+        "instead (defaults to the '--base-url' one, if given)"
+    )
+
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Increases logging verbosity"
     )
 
-    if "--no-scrape" not in sys.argv:
+    if (
+        "--no-scrape" not in sys.argv
+        and "--rebuild-stale" not in sys.argv
+        and "--migrate-dumps" not in sys.argv
+    ):
         parser.add_argument(
             "email",
             help="The email to log into your premium Blinkist account"
@@ -234,166 +389,438 @@ def main():
     # set up logger verbosity
     logger.set_verbose(log, args.verbose)
 
+    if args.base_url:
+        httpclient.set_site_url(args.base_url)
+    if args.api_url or args.base_url:
+        httpclient.set_api_url(args.api_url or args.base_url)
+    scraper.configure_rate_limits(
+        args.cooldown, args.min_cooldown, args.audio_workers)
+    listings.set_ttl(0 if args.refresh_listings else args.listings_ttl * 3600)
+    try:
+        dumps.set_format(args.dump_format)
+        if args.migrate_dumps:
+            dumps.check_format(args.migrate_dumps)
+    except ValueError as e:
+        parser.error(str(e))
+
     def generate_book_outputs(book_json, cover_img=False):
-        if args.create_html:
-            generator.generate_book_html(book_json, cover_img)
-        if args.create_epub:
-            generator.generate_book_epub(book_json)
-        if args.create_pdf:
-            generator.generate_book_pdf(book_json, cover_img)
+        generator.generate_book_outputs(
+            book_json,
+            html=args.create_html,
+            epub=args.create_epub,
+            pdf=args.create_pdf,
+            cover_img_file=cover_img,
+        )
+
+    # the driver threads only scrape the books' data (and capture the audio
+    # requests headers, which needs the browser too): downloading the audio,
+    # combining it and generating the output files happen in the background
+    # stages of this pipeline, so that the browsers never wait for them
+    stages = None
+
+    # books whose audio download needs freshly captured request headers,
+    # which only the driver threads can capture
+    audio_retries = queue.Queue()
+    # how many times the audio of each book was retried, and the books whose
+    # audio could not be downloaded
+    audio_attempts = {}
+    failed_audio = set()
+
+    # what was listed and done during the scrape run, to resume it from
+    run_journal = journal.Journal()
+    # the arguments deciding which books get listed, which can't change when
+    # resuming a run
+    listing_options = {
+        "language": args.language,
+        "match_language": args.match_language,
+        "books": args.books,
+        "categories": args.categories,
+        "ignore_categories": args.ignore_categories,
+    }
+    if args.resume and not (args.book or args.daily_book):
+        try:
+            run_journal.check_options(listing_options)
+        except ValueError as e:
+            parser.error(str(e))
+    # the states of a book that is completely done with
+    finished_states = {journal.SCRAPED, journal.GENERATED}
+    if args.audio:
+        finished_states.add(journal.AUDIO)
+        if args.concat_audio:
+            finished_states.add(journal.COMBINED)
+
+    def download_book_audio(book_json, audio_request_headers):
+        try:
+            audio_files = scraper.download_book_audio(
+                book_json, audio_request_headers,
+                max_workers=args.audio_workers
+            )
+        except scraper.AudioAuthError:
+            audio_retries.put(book_json)
+            return
+        if audio_files:
+            catalog.set_audio_status(book_json["slug"], "downloaded")
+            run_journal.record(book_json["slug"], journal.AUDIO)
+            queue_combine_audio(book_json, audio_files)
+
+    def queue_combine_audio(book_json, audio_files):
+        if args.concat_audio and type(audio_files) == list:
+            stages["combine"].put(book_json, audio_files)
+
+    def combine_book_audio(book_json, audio_files):
+        cover_file = False
+        if args.embed_cover_art:
+            # embedded straight from the covers cache
+            cover_file = covers.try_get_cover(book_json)
+        if generator.combine_audio(
+            book_json, audio_files, args.keep_noncat, cover_file
+        ):
+            catalog.set_audio_status(book_json["slug"], "combined")
+            run_journal.record(book_json["slug"], journal.COMBINED)
+
+    def generate_book(book_json):
+        cover_img_file = False
+        if args.save_cover:
+            cover_img_file = covers.save_cover(
+                book_json,
+                os.path.join(get_book_pretty_filepath(book_json), "cover.jpg")
+            )
+        generate_book_outputs(book_json, cover_img=cover_img_file)
+        run_journal.record(book_json["slug"], journal.GENERATED)
+
+    def start_stages():
+        pipeline_stages = pipeline.Pipeline()
+        # stages must be added in the order they feed each other
+        pipeline_stages.add(
+            "audio", download_book_audio, workers=args.workers)
+        pipeline_stages.add(
+            "combine", combine_book_audio, workers=args.ffmpeg_jobs)
+        pipeline_stages.add("generate", generate_book, workers=2)
+        return pipeline_stages
+
+    def retry_books_audio(driver, wait=False):
+        # retry the audio of the books whose headers were rejected, in the
+        # audio stage, or right away if 'wait' is set (once the audio stage
+        # is closed)
+        while True:
+            # several worker threads drain the queue at once: a book another
+            # one took in the meantime must not block this one
+            try:
+                book_json = audio_retries.get_nowait()
+            except queue.Empty:
+                break
+            slug = book_json["slug"]
+            # every retry may capture the headers again in the browser, which
+            # takes a while: don't insist on books that keep failing
+            audio_attempts[slug] = audio_attempts.get(slug, 0) + 1
+            if audio_attempts[slug] > AUDIO_RETRIES:
+                log.error(f"Audio requests for {slug} keep being rejected, "
+                          "giving up on its audio")
+                failed_audio.add(slug)
+                continue
+            # the rejected headers have been invalidated: they are captured
+            # again for the first book, then reused for the rest
+            audio_request_headers = scraper.get_audio_request_headers(
+                driver, book_json, args.language)
+            if not audio_request_headers:
+                log.error(f"Could not download audio for {slug}")
+                failed_audio.add(slug)
+                continue
+            if wait:
+                download_book_audio(book_json, audio_request_headers)
+            else:
+                stages["audio"].put(book_json, audio_request_headers)
 
     def scrape_book(
         driver, processed_books, book_url, category, match_language
     ):
+        if args.audio:
+            retry_books_audio(driver)
         book_json, dump_exists = scraper.scrape_book_data(
             driver, book_url, category=category, match_language=match_language
         )
         if book_json:
-            cover_img_file = False
-            cover_tmp_file = False
-            if args.audio:
+            run_journal.record(book_json["slug"], journal.SCRAPED)
+            if args.save_cover or args.embed_cover_art:
+                # download the cover in the background, for it to be ready
+                # once the book gets generated or its audio combined
+                covers.prefetch(book_json, [("640", "1_1")])
+            if args.audio and not book_json["is_audio"]:
+                run_journal.record(book_json["slug"], journal.NO_AUDIO)
+            elif args.audio:
                 audio_files = scraped_audio_exists(book_json)
+                if audio_files:
+                    run_journal.record(book_json["slug"], journal.AUDIO)
+                if audio_files is True:
+                    # the concatenated audio file already exists
+                    run_journal.record(book_json["slug"], journal.COMBINED)
                 if not audio_files:
-                    audio_files = scraper.scrape_book_audio(
-                        driver, book_json, args.language
-                    )
-                if audio_files and args.concat_audio:
-                    if type(audio_files) == list:
-                        if args.embed_cover_art:
-                            cover_tmp_file = scraper.download_book_cover_image(
-                                book_json, filename="_cover.jpg",
-                                alt_file="cover.jpg"
-                            )
-                        generator.combine_audio(
-                            book_json, audio_files, args.keep_noncat,
-                            cover_tmp_file
-                        )
-            if args.save_cover:
-                cover_img_file = scraper.download_book_cover_image(
-                    book_json, filename="cover.jpg", alt_file="_cover.jpg"
-                )
-                generate_book_outputs(book_json, cover_img=cover_img_file)
-            else:
-                generate_book_outputs(book_json)
-            if cover_tmp_file:
-                if os.path.exists(cover_tmp_file):
-                    log.debug(f"Deleting {cover_tmp_file}")
-                    os.remove(cover_tmp_file)
+                    # the headers are only captured in the browser once,
+                    # then reused as long as they are accepted
+                    audio_request_headers = scraper.get_audio_request_headers(
+                        driver, book_json, args.language)
+                    if audio_request_headers:
+                        stages["audio"].put(book_json, audio_request_headers)
                 else:
-                    log.debug(f'Could not find "{cover_tmp_file}"')
+                    queue_combine_audio(book_json, audio_files)
+            stages["generate"].put(book_json)
             processed_books.append(book_url)
+            progress.update()
         return dump_exists
 
     def finish(start_time, processed_books, driver=None):
         if driver:
             driver.close()
         elapsed_time = time.time() - start_time
-        formatted_time = "{:02d}:{:02d}:{:02d}".format(
-            int(elapsed_time // 3600),
-            int(elapsed_time % 3600 // 60),
-            int(elapsed_time % 60),
-        )
+        formatted_time = logger.format_duration(elapsed_time)
         total_books = len(processed_books)
         log.info(
             f"Processed {total_books} book{'s' if total_books != 1 else ''} "
             f"in {formatted_time}"
         )
+        # where the time went, stage by stage
+        report = metrics.write_report(args.metrics_file)
+        for stage, histogram in report["stages"].items():
+            log.info(
+                f"{stage}: {histogram['count']} in {histogram['sum']:.1f}s "
+                f"({histogram['mean']:.2f}s on average, "
+                f"{histogram['max']:.2f}s at most)"
+            )
+        if "audio_download_bytes_per_second" in report:
+            log.info(
+                "Audio downloaded at "
+                f"{report['audio_download_bytes_per_second'] / 1024:.0f} KB/s"
+            )
 
     # start scraping
     log.info("Starting scrape run...")
     processed_books = []
     start_time = time.time()
+    progress = logger.Progress(log)
 
-    if args.no_scrape:
+    if args.migrate_dumps:
+        converted = catalog.convert_dumps(
+            args.migrate_dumps, jobs=args.jobs or os.cpu_count())
+        log.info(
+            f"Converted {converted} dump{'s' if converted != 1 else ''} to "
+            f"{args.migrate_dumps} in "
+            f"{logger.format_duration(time.time() - start_time)}")
+    elif args.no_scrape or args.rebuild_stale:
         # if the --no-scrape argument is passed, just process the
         # existing json dump files
-        for file in glob.glob(os.path.join(os.getcwd(), "dump", "*.json")):
-            generate_book_outputs(file)
-            processed_books.append(file)
+        if args.rebuild_stale:
+            formats = [
+                format for format, enabled in [
+                    ("html", args.create_html),
+                    ("epub", args.create_epub),
+                    ("pdf", args.create_pdf),
+                ] if enabled
+            ]
+            dump_files = generator.get_stale_dump_files(formats)
+            log.info(
+                f"Found {len(dump_files)} book"
+                f"{'s' if len(dump_files) != 1 else ''} with stale outputs")
+        else:
+            dump_files = catalog.get_dump_paths()
+        progress.expect(len(dump_files))
+        if args.jobs != 1:
+            processed_books = generator.generate_books(
+                dump_files,
+                jobs=args.jobs or os.cpu_count(),
+                verbose=args.verbose,
+                html=args.create_html,
+                epub=args.create_epub,
+                pdf=args.create_pdf,
+            )
+        else:
+            for file in dump_files:
+                generate_book_outputs(file)
+                processed_books.append(file)
+                progress.update()
         finish(start_time, processed_books)
     else:
         match_language = args.language if args.match_language else ""
         start_headless = args.headless
         # add uBlock (except on headless)
         use_ublock = not args.no_ublock and not args.headless
-        driver = scraper.initialize_driver(
-            headless=start_headless,
-            with_ublock=use_ublock,
-            no_sandbox=args.no_sandbox,
-            chromedriver_path=args.chromedriver,
-        )
 
+        def start_driver():
+            return scraper.initialize_driver(
+                headless=start_headless,
+                with_ublock=use_ublock,
+                no_sandbox=args.no_sandbox,
+                chromedriver_path=args.chromedriver,
+                # only intercept requests when capturing the audio ones
+                with_interception=args.audio,
+            )
+
+        driver = start_driver()
         is_logged_in = scraper.login(
             driver, args.language, args.email, args.password)
         if is_logged_in:
-            if args.book or args.daily_book:
-                # scrape single book
-                book_url = (
-                    args.book
-                    if not args.daily_book
-                    else scraper.get_daily_book_url(driver, args.language)
-                )
-                scrape_book(
-                    driver,
-                    processed_books,
-                    book_url,
-                    category={"label": args.book_category},
-                    match_language=match_language,
-                )
-            elif args.books:
-                # scrape list of books
-                with open(args.books, "r") as books_urls:
-                    for book_url in books_urls.readlines():
-                        dump_exists = scrape_book(
-                            driver,
-                            processed_books,
-                            book_url.strip(),
-                            category={"label": args.book_category},
-                            match_language=match_language,
-                        )
-                        if not dump_exists:
-                            time.sleep(args.cooldown)
-            else:
-                # scrape all categories
-                categories = scraper.get_categories(
-                    driver,
-                    args.language,
-                    specified_categories=args.categories,
-                    ignored_categories=args.ignore_categories,
-                )
-                for category in categories:
-                    books_urls = scraper.get_all_books_for_categories(
-                        driver, category)
-                    for book_url in books_urls:
-                        dump_exists = scrape_book(
-                            driver,
+            stages = start_stages()
+            if not (args.book or args.daily_book):
+                # single books are not journaled, which would replace the
+                # journal of the last run
+                run_journal.open(
+                    resume=args.resume, options=listing_options)
+            try:
+                pool = None
+                if args.workers > 1 and not (args.book or args.daily_book):
+                    # the other workers log in using the cookies stored by the
+                    # first driver, and scrape books as soon as they are listed
+                    def start_worker_driver():
+                        worker_driver = start_driver()
+                        if scraper.login(
+                            worker_driver, args.language, args.email,
+                            args.password
+                        ):
+                            return worker_driver
+                        worker_driver.quit()
+                        return None
+
+                    pool = workers.DriverPool(
+                        start_worker_driver,
+                        lambda worker_driver, book_url, category: scrape_book(
+                            worker_driver,
                             processed_books,
                             book_url,
                             category=category,
                             match_language=match_language,
-                        )
-                        # if we processed the book from an existing dump
-                        # no scraping was involved, no need to cooldown
-                        if not dump_exists:
-                            time.sleep(args.cooldown)
-                # scrape all books to process uncategorized books
-                all_books = scraper.get_all_books(driver, match_language)
-                uncategorized_books = [
-                    x for x in all_books if x not in processed_books]
-                log.info(
-                    f"Scraping {len(uncategorized_books)} remaining "
-                    "uncategorized books..."
-                )
-                for book_url in uncategorized_books:
-                    dump_exists = scrape_book(
+                        ),
+                    )
+                    pool.start(args.workers - 1)
+
+                # slugs of the books listed in this run, whatever the url
+                # they were listed with
+                listed_books = set()
+                # slugs of the books never listed by any run before
+                new_books = set()
+
+                def process_book(book_url, category):
+                    book_slug = get_book_slug(book_url)
+                    if book_slug in listed_books:
+                        log.debug(
+                            f"Book {book_slug} already listed, skipping...")
+                        return
+                    listed_books.add(book_slug)
+                    progress.expect(len(listed_books))
+                    if run_journal.is_finished(book_slug, finished_states):
+                        log.debug(
+                            f"Book {book_slug} done in the resumed run, "
+                            "skipping...")
+                        return
+                    if not catalog.mark_seen(book_slug, book_url):
+                        new_books.add(book_slug)
+                        log.debug(f"Listed new book {book_slug}")
+                    if pool:
+                        pool.submit(book_url, category)
+                        return
+                    scrape_book(
+                        driver,
+                        processed_books,
+                        book_url,
+                        category=category,
+                        match_language=match_language,
+                    )
+
+                if args.book or args.daily_book:
+                    # scrape single book
+                    book_url = (
+                        args.book
+                        if not args.daily_book
+                        else scraper.get_daily_book_url(driver, args.language)
+                    )
+                    catalog.mark_seen(get_book_slug(book_url), book_url)
+                    progress.expect(1)
+                    scrape_book(
                         driver,
                         processed_books,
                         book_url,
-                        category={"label": "Uncategorized"},
+                        category={"label": args.book_category},
                         match_language=match_language,
                     )
-                    if not dump_exists:
-                        time.sleep(args.cooldown)
+                elif args.books:
+                    # scrape list of books
+                    with open(args.books, "r") as books_urls:
+                        books_urls = [
+                            book_url.strip()
+                            for book_url in books_urls.readlines()
+                            if book_url.strip()
+                        ]
+                    progress.expect(len(books_urls))
+                    for book_url in books_urls:
+                        process_book(
+                            book_url, category={"label": args.book_category})
+                else:
+                    # scrape all categories, unless they were already listed
+                    # by the resumed run
+                    categories = run_journal.categories
+                    if categories is None:
+                        categories = scraper.get_categories(
+                            driver,
+                            args.language,
+                            specified_categories=args.categories,
+                            ignored_categories=args.ignore_categories,
+                        )
+                        run_journal.record_categories(categories)
+                    for category in categories:
+                        books_urls = run_journal.get_plan(category["url"])
+                        if books_urls is None:
+                            books_urls = scraper.get_all_books_for_categories(
+                                driver, category)
+                            run_journal.record_plan(
+                                category["url"], books_urls)
+                        for book_url in books_urls:
+                            process_book(book_url, category=category)
+                    # scrape all books to process uncategorized books
+                    all_books = run_journal.get_plan("sitemap")
+                    if all_books is None:
+                        all_books = scraper.get_all_books(
+                            driver, match_language)
+                        run_journal.record_plan("sitemap", all_books)
+                    uncategorized_books = [
+                        x for x in all_books
+                        if get_book_slug(x) not in listed_books
+                    ]
+                    log.info(
+                        f"Scraping {len(uncategorized_books)} remaining "
+                        "uncategorized books..."
+                    )
+                    progress.expect(
+                        len(listed_books) + len(uncategorized_books))
+                    for book_url in uncategorized_books:
+                        process_book(
+                            book_url, category={"label": "Uncategorized"})
+                if new_books:
+                    log.info(
+                        f"Listed {len(new_books)} book"
+                        f"{'s' if len(new_books) != 1 else ''} never listed "
+                        "before")
+                if pool:
+                    # listing is over, the main driver can now scrape books
+                    # too. it is kept open afterwards to retry the audio
+                    pool.adopt(driver)
+                    pool.join(keep=driver)
+                # wait for the audio downloads, then retry the ones whose
+                # headers were rejected before the later stages are closed
+                stages["audio"].close()
+                if args.audio:
+                    retry_books_audio(driver, wait=True)
+                # wait for the background stages to process every book
+                stages.close()
+                if failed_audio:
+                    log.warning(
+                        f"Audio of {len(failed_audio)} book"
+                        f"{'s' if len(failed_audio) != 1 else ''} could "
+                        "not be downloaded, it will be on the next run")
+                else:
+                    run_journal.complete()
+            except KeyboardInterrupt:
+                stages.stop()
+                raise
+            finally:
+                run_journal.close()
         else:
             log.error("Unable to login into Blinkist")
         finish(start_time, processed_books, driver)
@@ -407,17 +834,19 @@ def sys_exit():
         os._exit(0)
 
 
-# catch all errors and exit properly
-try:
-    main()
+# guard against worker processes re-running the script when importing it
+if __name__ == "__main__":
+    # catch all errors and exit properly
+    try:
+        main()
 
-# exiting via keyboard
-except KeyboardInterrupt:
-    log.critical("Interrupted by user")
-    sys_exit()
+    # exiting via keyboard
+    except KeyboardInterrupt:
+        log.critical("Interrupted by user")
+        sys_exit()
 
-# other errors...
-except Exception as e:
-    log.exception(e)
-    log.critical('Uncaught Exception. Exiting...')
-    sys_exit()
+    # other errors...
+    except Exception as e:
+        log.exception(e)
+        log.critical('Uncaught Exception. Exiting...')
+        sys_exit()
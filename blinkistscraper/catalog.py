@@ -0,0 +1,397 @@
+import os
+import glob
+import json
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import dumps
+import logger
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+CATALOG_FILE = "catalog.db"
+DUMP_DIR = dumps.DUMP_DIR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    slug TEXT PRIMARY KEY,
+    book_id TEXT,
+    dump_path TEXT NOT NULL,
+    content_hash TEXT,
+    dump_mtime INTEGER,
+    category TEXT,
+    language TEXT,
+    is_audio INTEGER,
+    audio_status TEXT
+);
+CREATE INDEX IF NOT EXISTS books_book_id ON books (book_id);
+CREATE TABLE IF NOT EXISTS outputs (
+    slug TEXT NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT NOT NULL,
+    input_hash TEXT,
+    PRIMARY KEY (slug, format)
+);
+CREATE TABLE IF NOT EXISTS seen_books (
+    slug TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    first_seen TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_local = threading.local()
+_sync_lock = threading.Lock()
+_synced_pid = None
+
+
+def get_connection():
+    # sqlite connections can't be shared between threads, nor survive a fork,
+    # so keep one per thread and per process
+    connection = getattr(_local, "connection", None)
+    if connection is None or _local.pid != os.getpid():
+        connection = sqlite3.connect(CATALOG_FILE, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        migrate(connection)
+        _local.connection = connection
+        _local.pid = os.getpid()
+        sync_dumps(connection)
+    return connection
+
+
+def migrate(connection):
+    # add the columns missing from catalogs created by older versions
+    output_columns = [
+        row[1] for row in connection.execute("PRAGMA table_info(outputs)")
+    ]
+    if "input_hash" not in output_columns:
+        connection.execute("ALTER TABLE outputs ADD COLUMN input_hash TEXT")
+    book_columns = [
+        row[1] for row in connection.execute("PRAGMA table_info(books)")
+    ]
+    if "dump_mtime" not in book_columns:
+        connection.execute("ALTER TABLE books ADD COLUMN dump_mtime INTEGER")
+    connection.commit()
+
+
+def get_dump_dir_mtime():
+    try:
+        return str(os.stat(DUMP_DIR).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def set_meta(connection, key, value):
+    connection.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+def get_meta(connection, key):
+    row = connection.execute(
+        "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def sync_dumps(connection):
+    """
+    Reconciles the catalog with the dump folder, indexing the dumps it
+    doesn't know about (e.g. from before the catalog existed, or copied over
+    by hand) and forgetting the deleted ones.
+
+    This only lists the dump folder if its modification time changed since
+    the last sync, and only once per process.
+    """
+    global _synced_pid
+    with _sync_lock:
+        if _synced_pid == os.getpid():
+            return
+        _synced_pid = os.getpid()
+
+    dump_dir_mtime = get_dump_dir_mtime()
+    if dump_dir_mtime is None or dump_dir_mtime == get_meta(
+        connection, "dump_dir_mtime"
+    ):
+        return
+
+    log.debug("Dump folder changed, syncing the catalog...")
+    indexed_files = set(
+        row[0] for row in connection.execute("SELECT dump_path FROM books")
+    )
+    dump_files = set()
+    for extension in dumps.EXTENSIONS:
+        dump_files.update(
+            glob.glob(os.path.join(DUMP_DIR, "*" + extension)))
+    for dump_file in sorted(dump_files - indexed_files):
+        try:
+            book_json = dumps.read_book(dump_file)
+        except (OSError, ValueError) as e:
+            log.warning(f"Could not index {dump_file}: {e}")
+            continue
+        record_dump(book_json, dump_file, get_book_hash(book_json),
+                    connection=connection)
+    for dump_file in indexed_files - dump_files:
+        forget_dump(dump_file, connection=connection)
+    set_meta(connection, "dump_dir_mtime", dump_dir_mtime)
+    connection.commit()
+    log.debug(f"Catalog synced, {len(dump_files)} dumps indexed")
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_dump_mtime(dump_path):
+    # the latest change to either of the dump's files
+    mtimes = [
+        mtime for mtime in [
+            get_mtime(dump_path),
+            get_mtime(dumps.get_content_filename(dump_path)),
+        ] if mtime is not None
+    ]
+    return max(mtimes) if mtimes else None
+
+
+def refresh_dump_hash(dump_path, content_hash, dump_mtime, connection):
+    # dumps can be edited in place, which doesn't change the dump folder's
+    # mtime: re-index a dump whenever its own mtime changed
+    if get_dump_mtime(dump_path) == dump_mtime:
+        return content_hash
+    try:
+        book_json = dumps.read_book(dump_path)
+    except (OSError, ValueError) as e:
+        log.warning(f"Could not index {dump_path}: {e}")
+        return content_hash
+    content_hash = get_book_hash(book_json)
+    record_dump(book_json, dump_path, content_hash, connection=connection)
+    connection.commit()
+    return content_hash
+
+
+def get_content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
+def get_book_hash(book_json):
+    # the hash of the book as it is dumped, split from its chapters' content
+    # (see dumps.split_book) and with sorted keys: a book read back from its
+    # dump, in any format and layout, hashes the same as when it was scraped
+    metadata, content = dumps.split_book(book_json)
+    return get_content_hash(json.dumps(
+        [metadata, content], sort_keys=True, separators=(",", ":")
+    ).encode("utf-8"))
+
+
+def record_dump(book_json, dump_path, content_hash, connection=None):
+    commit = connection is None
+    connection = connection or get_connection()
+    connection.execute(
+        "INSERT OR REPLACE INTO books (slug, book_id, dump_path, "
+        "content_hash, dump_mtime, category, language, is_audio, "
+        "audio_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, "
+        "(SELECT audio_status FROM books WHERE slug = ?))",
+        (
+            book_json["slug"],
+            str(book_json.get("id", "")),
+            dump_path,
+            content_hash,
+            get_dump_mtime(dump_path),
+            book_json.get("category"),
+            book_json.get("language"),
+            1 if book_json.get("is_audio") else 0,
+            book_json["slug"],
+        ),
+    )
+    if commit:
+        # the dump folder changed because of us, no need to sync it again
+        set_meta(connection, "dump_dir_mtime", get_dump_dir_mtime())
+        connection.commit()
+
+
+def forget_dump(dump_path, connection=None):
+    commit = connection is None
+    connection = connection or get_connection()
+    for (slug,) in connection.execute(
+        "SELECT slug FROM books WHERE dump_path = ?", (dump_path,)
+    ).fetchall():
+        connection.execute("DELETE FROM outputs WHERE slug = ?", (slug,))
+    connection.execute("DELETE FROM books WHERE dump_path = ?", (dump_path,))
+    if commit:
+        connection.commit()
+
+
+def move_dump(dump_path, new_dump_path, connection=None):
+    # the dump was stored in another format or layout: the book, and so its
+    # hash and the outputs generated from it, are unchanged
+    commit = connection is None
+    connection = connection or get_connection()
+    connection.execute(
+        "UPDATE books SET dump_path = ?, dump_mtime = ? WHERE dump_path = ?",
+        (new_dump_path, get_dump_mtime(new_dump_path), dump_path),
+    )
+    if commit:
+        set_meta(connection, "dump_dir_mtime", get_dump_dir_mtime())
+        connection.commit()
+
+
+def convert_dumps(format, jobs=1):
+    """
+    Stores every dump in 'format', split from its chapters' content (see the
+    dumps module), over a pool of 'jobs' worker processes. Returns the number
+    of dumps converted.
+    """
+    dump_files = get_dump_paths()
+    log.info(
+        f"Checking {len(dump_files)} dump"
+        f"{'s' if len(dump_files) != 1 else ''}...")
+    connection = get_connection()
+    converted = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(dumps.convert, dump_file, format): dump_file
+            for dump_file in dump_files
+        }
+        for count, future in enumerate(as_completed(futures), start=1):
+            dump_file = futures[future]
+            try:
+                new_dump_file = future.result()
+            except Exception as e:
+                log.error(f"[{count}/{len(futures)}] Failed converting "
+                          f"{dump_file}: {e}")
+                continue
+            if not new_dump_file:
+                # already in 'format', and split
+                continue
+            move_dump(dump_file, new_dump_file, connection=connection)
+            converted += 1
+            log.debug(f"[{count}/{len(futures)}] Converted {dump_file}")
+            # don't lose the progress if interrupted
+            if converted % 500 == 0:
+                connection.commit()
+    set_meta(connection, "dump_dir_mtime", get_dump_dir_mtime())
+    connection.commit()
+    return converted
+
+
+def get_dump_path(slug):
+    # returns the path of the book's dump, or None if it was never dumped
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT dump_path FROM books WHERE slug = ?", (slug,)).fetchone()
+    if not row:
+        return None
+    if not os.path.exists(row[0]):
+        # the dump has been deleted behind our back
+        forget_dump(row[0])
+        return None
+    return row[0]
+
+
+def get_dump_paths():
+    connection = get_connection()
+    return [
+        row[0] for row in connection.execute(
+            "SELECT dump_path FROM books ORDER BY dump_path")
+    ]
+
+
+def get_audio_status(slug):
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT audio_status FROM books WHERE slug = ?", (slug,)).fetchone()
+    return row[0] if row else None
+
+
+def set_audio_status(slug, status):
+    # status is either "downloaded" or "combined", or None to reset it
+    connection = get_connection()
+    connection.execute(
+        "UPDATE books SET audio_status = ? WHERE slug = ?", (status, slug))
+    connection.commit()
+
+
+def get_dump_hash(slug):
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT dump_path, content_hash, dump_mtime FROM books "
+        "WHERE slug = ?", (slug,)).fetchone()
+    if not row:
+        return None
+    return refresh_dump_hash(*row, connection=connection)
+
+
+def record_output(book_json, format, path, input_hash=None):
+    # input_hash identifies the inputs (dump and templates) the output was
+    # generated from, to tell when it needs to be generated again
+    connection = get_connection()
+    connection.execute(
+        "INSERT OR REPLACE INTO outputs (slug, format, path, input_hash) "
+        "VALUES (?, ?, ?, ?)",
+        (book_json["slug"], format, path, input_hash),
+    )
+    connection.commit()
+
+
+def get_output_hash(slug, format):
+    # returns the input hash recorded for the output, or None if unknown
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT input_hash FROM outputs WHERE slug = ? AND format = ?",
+        (slug, format),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_outputs(formats):
+    """
+    Lists every dumped book with the recorded path and input hash of each
+    of its outputs in 'formats', as (slug, dump_path, content_hash, outputs)
+    tuples where outputs maps each format to a (path, input_hash) tuple (the
+    hash may be None).
+    """
+    connection = get_connection()
+    placeholders = ", ".join("?" for _ in formats)
+    books = {}
+    for (
+        slug, dump_path, content_hash, dump_mtime, format, path, input_hash
+    ) in (
+        connection.execute(
+            "SELECT books.slug, books.dump_path, books.content_hash, "
+            "books.dump_mtime, outputs.format, outputs.path, "
+            "outputs.input_hash FROM books "
+            "LEFT JOIN outputs ON outputs.slug = books.slug "
+            f"AND outputs.format IN ({placeholders}) "
+            "ORDER BY books.dump_path",
+            list(formats),
+        )
+    ):
+        if slug not in books:
+            content_hash = refresh_dump_hash(
+                dump_path, content_hash, dump_mtime, connection)
+            books[slug] = (slug, dump_path, content_hash, {})
+        if format:
+            books[slug][3][format] = (path, input_hash)
+    return list(books.values())
+
+
+def mark_seen(slug, url):
+    # records a listed book, returning whether it was ever listed before
+    connection = get_connection()
+    cursor = connection.execute(
+        "INSERT OR IGNORE INTO seen_books (slug, url) VALUES (?, ?)",
+        (slug, url),
+    )
+    connection.commit()
+    return cursor.rowcount == 0
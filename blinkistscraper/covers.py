@@ -0,0 +1,173 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copyfile as copy_file
+
+import requests
+
+import logger
+from download import download_file, DownloadError
+from utils import get_hashed_filename, replacing
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+# resize the covers locally if Pillow is available, instead of downloading
+# each size of them
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    Image = None
+
+COVERS_DIR = os.path.join("cache", "covers")
+# the largest size Blinkist serves the covers in, the other ones are
+# resized from it
+SOURCE_SIZE = "1400"
+PREFETCH_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+# a lock for each cache file, not to fetch the same cover twice at once
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_cover_url(book_json, size="640", type="1_1"):
+    """
+    Returns the url of the cover of 'book_json', in 'size' (its width in
+    pixels, generally one of 130, 250, 470, 640, 1080 or 1400) and 'type'
+    (its aspect ratio, generally one of '1_1', '2-2_1' or '3_4').
+
+    The default 'image_url' (used by the HTML output) is type '3_4', size
+    640. Returns None if the book has no cover.
+    """
+    url_template = (book_json.get("images") or {}).get("url_template")
+    if not url_template:
+        return None
+    return url_template.replace("%type%", type).replace("%size%", size)
+
+
+def get_cache_filename(url):
+    # covers are stored under the hash of their url, so that books sharing a
+    # cover (e.g. in several languages) only download it once
+    return get_hashed_filename(COVERS_DIR, url, ".jpg")
+
+
+def resize(source_file, cover_file, size):
+    with Image.open(source_file) as image:
+        width = int(size)
+        height = round(image.height * width / image.width)
+        resized = image.convert("RGB").resize((width, height), Image.LANCZOS)
+        with replacing(cover_file) as tmp_file:
+            resized.save(tmp_file, "JPEG", quality=90)
+
+
+def find_cover(book_json, size="640", type="1_1"):
+    # returns the cached cover if it was already fetched, or None
+    url = get_cover_url(book_json, size, type)
+    if not url:
+        return None
+    cover_file = get_cache_filename(url)
+    return cover_file if os.path.exists(cover_file) else None
+
+
+def get_lock(cover_file):
+    with _locks_lock:
+        return _locks.setdefault(cover_file, threading.Lock())
+
+
+def get_cover(book_json, size="640", type="1_1"):
+    """
+    Returns the cached file of the cover of 'book_json' in 'size' and 'type'
+    (see get_cover_url), fetching it if needed, or None if the book has no
+    cover.
+    """
+    url = get_cover_url(book_json, size, type)
+    if not url:
+        return None
+    cover_file = get_cache_filename(url)
+    if os.path.exists(cover_file):
+        return cover_file
+    # a resized cover's lock is taken before its source's, never after
+    with get_lock(cover_file):
+        if os.path.exists(cover_file):
+            # fetched while waiting for the lock
+            return cover_file
+        if not os.path.exists(COVERS_DIR):
+            os.makedirs(COVERS_DIR, exist_ok=True)
+        if Image and size != SOURCE_SIZE:
+            # resize the largest size of the cover, downloading it only once
+            # for every size needed
+            try:
+                source_file = get_cover(book_json, SOURCE_SIZE, type)
+                resize(source_file, cover_file, size)
+                log.debug(
+                    f"Resized the cover of {book_json['slug']} to {size}")
+                return cover_file
+            except Exception as e:
+                log.debug(f"Could not resize the cover of {book_json['slug']}"
+                          f", downloading it instead: {e}")
+        log.info(f'Downloading "{url}"')
+        download_file(url, cover_file)
+    return cover_file
+
+
+def prefetch_cover(book_json, size, type):
+    try:
+        get_cover(book_json, size, type)
+    except Exception as e:
+        # get_cover will try again, and report it, when the cover is needed
+        log.debug(f"Could not prefetch the cover of {book_json['slug']}: {e}")
+
+
+def prefetch(book_json, variants):
+    """
+    Starts fetching the covers of 'book_json' in every (size, type) of
+    'variants' on a pool of threads, for get_cover to find them ready.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+    for size, type in variants:
+        url = get_cover_url(book_json, size, type)
+        if url and not os.path.exists(get_cache_filename(url)):
+            _executor.submit(prefetch_cover, book_json, size, type)
+
+
+def link_cover(cover_file, filename):
+    # hardlink the cached cover into the book folder, which takes no space,
+    # or copy it where hardlinks aren't supported (e.g. across drives)
+    if os.path.exists(filename):
+        return filename
+    try:
+        os.link(cover_file, filename)
+    except OSError:
+        copy_file(cover_file, filename)
+    return filename
+
+
+def try_get_cover(book_json, size="640", type="1_1"):
+    # like get_cover, but returns False if the cover could not be fetched,
+    # or if the book has no cover
+    try:
+        return get_cover(book_json, size, type) or False
+    except (requests.exceptions.RequestException, DownloadError) as e:
+        log.warning(f"Could not download the cover of {book_json['slug']}: "
+                    f"{e}")
+        return False
+
+
+def save_cover(book_json, filename, size="640", type="1_1"):
+    """
+    Saves the cover of 'book_json' in 'size' and 'type' as 'filename',
+    returning it, or False if the cover could not be fetched.
+    """
+    if os.path.exists(filename):
+        log.debug(f"{filename} already exists, skipping...")
+        return filename
+    cover_file = try_get_cover(book_json, size, type)
+    if not cover_file:
+        return False
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    return link_cover(cover_file, filename)
@@ -0,0 +1,79 @@
+import os
+
+import httpclient
+import logger
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def get_partial_filename(filename):
+    return filename + ".part"
+
+
+def download_file(url, filename, chunk_size=CHUNK_SIZE, timeout=60):
+    """
+    Streams the file at 'url' to 'filename'.
+
+    The content is written in chunks to a '.part' file next to 'filename',
+    which is only renamed to 'filename' once complete, so an existing
+    'filename' is always a complete download. If a '.part' file is left over
+    by an interrupted download, the download resumes from where it stopped
+    using an HTTP Range request (or starts over if the server ignores it).
+
+    Raises DownloadError if the size of the downloaded file doesn't match the
+    size announced by the server. The '.part' file is kept in that case, so
+    the download can resume on the next attempt.
+    """
+    part_file = get_partial_filename(filename)
+    resume_from = 0
+    headers = {}
+    if os.path.exists(part_file):
+        resume_from = os.path.getsize(part_file)
+        if resume_from:
+            headers["Range"] = f"bytes={resume_from}-"
+
+    with httpclient.get(
+        url, headers=headers, stream=True, timeout=timeout
+    ) as response:
+        if response.status_code == 416:
+            # the partial file is already as long as (or longer than) the
+            # remote one, there is no way to tell what's in it: start over
+            log.debug(f"Can't resume {part_file}, downloading it again")
+            os.remove(part_file)
+            return download_file(url, filename, chunk_size, timeout)
+        response.raise_for_status()
+
+        if resume_from and response.status_code == 206:
+            log.debug(f"Resuming download of {url} at {resume_from} bytes")
+            mode = "ab"
+        else:
+            # the server ignored the Range header and sent the whole file
+            resume_from = 0
+            mode = "wb"
+
+        # the Content-Length only matches the written bytes if the content
+        # wasn't encoded for the transfer
+        expected_size = None
+        content_length = response.headers.get("Content-Length")
+        if content_length and not response.headers.get("Content-Encoding"):
+            expected_size = resume_from + int(content_length)
+
+        with open(part_file, mode) as outfile:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                outfile.write(chunk)
+
+    downloaded_size = os.path.getsize(part_file)
+    if expected_size is not None and downloaded_size != expected_size:
+        raise DownloadError(
+            f"Downloaded {downloaded_size} bytes out of {expected_size} from "
+            f"{url}"
+        )
+
+    os.replace(part_file, filename)
+    return filename
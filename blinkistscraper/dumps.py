@@ -0,0 +1,239 @@
+import os
+import gzip
+import json
+
+import logger
+# utils imports this module: import it whole for the cycle to resolve
+import utils
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+# use orjson to (de)serialize the dumps if available, it's several times
+# faster than the json module
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+# zstd compresses better and decompresses faster than gzip, if available
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+DUMP_DIR = "dump"
+# the chapters' content of every dump is stored apart from the rest of the
+# book's metadata, in a file of the same name in this subfolder
+CONTENT_DIR = "content"
+# the chapter keys stored in the content file
+CONTENT_KEYS = ["content", "supplement"]
+
+# the dump formats, by extension
+FORMATS = {
+    "json": ".json",
+    "json.gz": ".json.gz",
+    "json.zst": ".json.zst",
+}
+EXTENSIONS = list(FORMATS.values())
+
+_format = "json"
+
+
+def check_format(format):
+    # raises a ValueError if dumps can't be written in 'format'
+    if format == "json.zst" and not zstandard:
+        raise ValueError(
+            "The 'zstandard' package needs to be installed for json.zst dumps")
+
+
+def set_format(format):
+    # the format new dumps are written in
+    global _format
+    check_format(format)
+    _format = format
+
+
+def get_format():
+    return _format
+
+
+def get_extension(format=None):
+    return FORMATS[format or _format]
+
+
+def get_filename_format(filename):
+    # longest extensions first, as ".json" ends every other one too
+    for format, extension in sorted(
+        FORMATS.items(), key=lambda item: -len(item[1])
+    ):
+        if filename.endswith(extension):
+            return format
+    return None
+
+
+def loads(content):
+    if orjson:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def serialize(book_json, format=None):
+    # plain json dumps stay indented as they always were, so that they can be
+    # read and edited by hand, the compressed ones don't need to
+    if (format or _format) == "json":
+        return json.dumps(book_json, indent=4).encode("utf-8")
+    if orjson:
+        return orjson.dumps(book_json)
+    return json.dumps(book_json, separators=(",", ":")).encode("utf-8")
+
+
+def compress(content, format):
+    if format == "json.gz":
+        # no timestamp in the header, the same content always gives the
+        # same file
+        return gzip.compress(content, compresslevel=6, mtime=0)
+    if format == "json.zst":
+        return zstandard.ZstdCompressor(level=10).compress(content)
+    return content
+
+
+def decompress(content, format):
+    if format == "json.gz":
+        return gzip.decompress(content)
+    if format == "json.zst":
+        if not zstandard:
+            raise ValueError(
+                "The 'zstandard' package needs to be installed to read "
+                "json.zst dumps")
+        return zstandard.ZstdDecompressor().decompress(content)
+    return content
+
+
+def read_content(filename):
+    # returns the json content of the file 'filename', decompressed if needed
+    with open(filename, "rb") as f:
+        content = f.read()
+    return decompress(content, get_filename_format(filename))
+
+
+def read(filename):
+    # only reads the book's metadata, see load_book_content
+    return loads(read_content(filename))
+
+
+def read_book(filename):
+    return load_book_content(read(filename), filename)
+
+
+def get_content_filename(filename):
+    return os.path.join(
+        os.path.dirname(filename), CONTENT_DIR, os.path.basename(filename))
+
+
+def has_content(book_json):
+    # whether the chapters' content is in 'book_json' already: either it was
+    # never dumped, or it was dumped in a single file before they were split
+    return any(
+        key in chapter_json
+        for chapter_json in book_json.get("chapters", [])
+        for key in CONTENT_KEYS
+    )
+
+
+def split_book(book_json):
+    """
+    Splits 'book_json' into its metadata (everything but the chapters'
+    content, a few kilobytes at most) and the chapters' content.
+    """
+    metadata = dict(book_json)
+    metadata["chapters"] = []
+    content = {"chapters": []}
+    for chapter_json in book_json.get("chapters", []):
+        metadata["chapters"].append({
+            key: value for key, value in chapter_json.items()
+            if key not in CONTENT_KEYS
+        })
+        content["chapters"].append({
+            key: chapter_json.get(key) for key in CONTENT_KEYS
+        })
+    return metadata, content
+
+
+def load_book_content(book_json, filename=None):
+    """
+    Returns 'book_json' with its chapters' content, loading it from the dump
+    'filename' (looked up in the dump folder by slug if not given) unless it
+    is there already. Only the generators need it.
+    """
+    if has_content(book_json) or not book_json.get("chapters"):
+        return book_json
+    if filename:
+        content_files = [get_content_filename(filename)]
+    else:
+        content_files = [
+            os.path.join(DUMP_DIR, CONTENT_DIR, book_json["slug"] + extension)
+            for extension in EXTENSIONS
+        ]
+    for content_file in content_files:
+        if os.path.exists(content_file):
+            break
+    else:
+        log.warning(f"The chapters' content of {book_json['slug']} is missing")
+        return book_json
+    content = read(content_file)
+    book_json = dict(book_json)
+    book_json["chapters"] = [
+        {**chapter_json, **chapter_content}
+        for chapter_json, chapter_content in zip(
+            book_json["chapters"], content["chapters"])
+    ]
+    return book_json
+
+
+def write_book(filename, book_json, format=None):
+    """
+    Dumps 'book_json' to 'filename', its chapters' content to the content
+    file next to it. Returns the dump's files.
+    """
+    metadata, content = split_book(book_json)
+    content_file = get_content_filename(filename)
+    if not os.path.exists(os.path.dirname(content_file)):
+        os.makedirs(os.path.dirname(content_file), exist_ok=True)
+    # the content goes first, for the metadata to never refer to missing
+    # content
+    write(content_file, serialize(content, format), format)
+    write(filename, serialize(metadata, format), format)
+    return [filename, content_file]
+
+
+def remove_book(filename):
+    for file in [filename, get_content_filename(filename)]:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def write(filename, content, format=None):
+    # 'content' is the serialized json, compressed here as the format needs.
+    # it's written to a temporary file first, never to leave a partial dump
+    with utils.atomic_open(filename, "wb") as outfile:
+        outfile.write(compress(content, format or _format))
+    return filename
+
+
+def convert(filename, format):
+    """
+    Stores the dump 'filename' in 'format', split from its chapters' content
+    if it wasn't, deleting the original files. Returns the new filename, or
+    None if there was nothing to do. The book itself (and so its hash in the
+    catalog) is unchanged.
+    """
+    metadata = read(filename)
+    source_format = get_filename_format(filename)
+    new_filename = filename[:-len(FORMATS[source_format])] + FORMATS[format]
+    if new_filename == filename and not has_content(metadata):
+        return None
+    book_json = load_book_content(metadata, filename)
+    write_book(new_filename, book_json, format)
+    if new_filename != filename:
+        remove_book(filename)
+    return new_filename
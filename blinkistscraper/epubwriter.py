@@ -0,0 +1,336 @@
+import re
+import time
+import zipfile
+from html import escape
+from html.entities import name2codepoint
+from html.parser import HTMLParser
+from xml.parsers import expat
+
+import logger
+import template
+from utils import replacing
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+# the parts of the epub that are the same for every book, or only need a few
+# values filled in, prepared once and shared by every book
+MIMETYPE = "application/epub+zip"
+# compressing is most of the time spent writing an epub: the fastest level
+# is about a third faster than the default one, for 10% bigger files
+COMPRESS_LEVEL = 1
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container"
+    version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml"
+        full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+"""
+
+PACKAGE_TEMPLATE = template.Template("""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id"
+    version="3.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <meta property="dcterms:modified">{modified}</meta>
+    <dc:identifier id="id">{identifier}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>{language}</dc:language>
+    <dc:creator id="creator">{author}</dc:creator>
+    <dc:description>{description}</dc:description>{cover_meta}
+  </metadata>
+  <manifest>
+    <item href="nav.xhtml" id="nav" media-type="application/xhtml+xml"
+        properties="nav"/>
+    <item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>
+    <item href="style/nav.css" id="style_nav" media-type="text/css"/>{items}
+  </manifest>
+  <spine toc="ncx">{itemrefs}
+  </spine>
+</package>
+""")
+
+COVER_META = """
+    <meta name="cover" content="cover-image"/>"""
+COVER_ITEMS = """
+    <item href="images/cover.jpg" id="cover-image" media-type="image/jpeg"
+        properties="cover-image"/>
+    <item href="cover.xhtml" id="cover" media-type="application/xhtml+xml"/>"""
+ITEM_TEMPLATE = template.Template("""
+    <item href="{href}" id="{id}" media-type="application/xhtml+xml"/>""")
+ITEMREF_TEMPLATE = template.Template("""
+    <itemref idref="{id}"/>""")
+
+NCX_TEMPLATE = template.Template("""<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta content="{identifier}" name="dtb:uid"/>
+    <meta content="1" name="dtb:depth"/>
+    <meta content="0" name="dtb:totalPageCount"/>
+    <meta content="0" name="dtb:maxPageNumber"/>
+  </head>
+  <docTitle>
+    <text>{title}</text>
+  </docTitle>
+  <navMap>{nav_points}
+  </navMap>
+</ncx>
+""")
+NAV_POINT_TEMPLATE = template.Template("""
+    <navPoint id="{id}" playOrder="{play_order}">
+      <navLabel>
+        <text>{title}</text>
+      </navLabel>
+      <content src="{href}"/>
+    </navPoint>""")
+
+XHTML_TEMPLATE = template.Template("""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml"
+    xmlns:epub="http://www.idpf.org/2007/ops"
+    lang="{language}" xml:lang="{language}">
+  <head>
+    <title>{title}</title>
+    <link href="style/nav.css" rel="stylesheet" type="text/css"/>
+  </head>
+  <body>
+{body}
+  </body>
+</html>
+""")
+NAV_BODY_TEMPLATE = template.Template("""\
+    <nav epub:type="toc" id="toc" role="doc-toc">
+      <h2>{title}</h2>
+      <ol>{links}
+      </ol>
+    </nav>""")
+NAV_LINK_TEMPLATE = template.Template("""
+        <li><a href="{href}">{title}</a></li>""")
+COVER_BODY_TEMPLATE = template.Template(
+    """    <img src="images/cover.jpg" alt="{title}"/>""")
+CHAPTER_BODY_TEMPLATE = template.Template("""    <h2>{title}</h2>
+{content}""")
+
+# html named entities are undefined in xhtml, except for these
+XML_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+ENTITY = re.compile(r"&(\w+);")
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "source", "track", "wbr",
+}
+# elements whose end tag html allows to omit, by the start tags that end
+# them implicitly
+IMPLIED_END = {
+    "li": {"li"},
+    "dt": {"dt", "dd"},
+    "dd": {"dt", "dd"},
+    "tr": {"tr"},
+    "td": {"td", "th", "tr"},
+    "th": {"td", "th", "tr"},
+    "option": {"option"},
+    "p": {
+        "address", "blockquote", "div", "dl", "h1", "h2", "h3", "h4", "h5",
+        "h6", "hr", "ol", "p", "pre", "table", "ul",
+    },
+}
+# the elements an implied end tag doesn't reach past
+CONTAINERS = {"ul", "ol", "dl", "table", "select", "div", "blockquote"}
+ATTRIBUTE_NAME = re.compile(r"^[A-Za-z_:][\w.:-]*$")
+
+
+def replace_entity(match):
+    name = match.group(1)
+    if name in XML_ENTITIES or name not in name2codepoint:
+        return match.group(0)
+    return f"&#{name2codepoint[name]};"
+
+
+def is_well_formed(content):
+    parser = expat.ParserCreate()
+    try:
+        parser.Parse(f"<div>{content}</div>", True)
+    except expat.ExpatError:
+        return False
+    return True
+
+
+class XHTMLConverter(HTMLParser):
+    """
+    Rewrites an html fragment as well-formed xhtml: void elements are
+    self-closed, unclosed elements closed, stray end tags dropped, and
+    attributes and text escaped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+
+    def get_starttag(self, tag, attrs, close=False):
+        attributes = "".join(
+            f' {name}="{escape(value if value is not None else name)}"'
+            for name, value in attrs if ATTRIBUTE_NAME.match(name)
+        )
+        return f"<{tag}{attributes}{'/' if close else ''}>"
+
+    def end_implied(self, tag):
+        # e.g. a li ends the previous li, unless within a new list
+        for index in range(len(self.open_tags) - 1, -1, -1):
+            open_tag = self.open_tags[index]
+            if tag in IMPLIED_END.get(open_tag, ()):
+                while len(self.open_tags) > index:
+                    self.parts.append(f"</{self.open_tags.pop()}>")
+                # e.g. a tr ends the previous td, then the previous tr
+                return self.end_implied(tag)
+            if open_tag in CONTAINERS:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self.end_implied(tag)
+        is_void = tag in VOID_ELEMENTS
+        self.parts.append(self.get_starttag(tag, attrs, close=is_void))
+        if not is_void:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.parts.append(self.get_starttag(tag, attrs, close=True))
+
+    def handle_endtag(self, tag):
+        if tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.parts.append(escape(data, quote=False))
+
+    def convert(self, content):
+        self.feed(content)
+        self.close()
+        while self.open_tags:
+            self.parts.append(f"</{self.open_tags.pop()}>")
+        return "".join(self.parts)
+
+
+def to_xhtml(content):
+    # most of the scraped html is well-formed already, and only needs its
+    # named entities replaced
+    if not content:
+        return ""
+    content = ENTITY.sub(replace_entity, content)
+    if is_well_formed(content):
+        return content
+    return XHTMLConverter().convert(content)
+
+
+def get_chapter_href(chapter_json):
+    return f"chapter_{chapter_json['order_no']}.xhtml"
+
+
+def render_chapter(chapter_json, language):
+    title = escape(chapter_json.get("title") or "", quote=False)
+    content = to_xhtml(chapter_json.get("content")) + to_xhtml(
+        chapter_json.get("supplement"))
+    return XHTML_TEMPLATE.render({
+        "language": language,
+        "title": title,
+        "body": CHAPTER_BODY_TEMPLATE.render(
+            {"title": title, "content": content}),
+    })
+
+
+def write_archive(filename, book_json, css, cover_file):
+    # every chapter is written into the zip as soon as it is rendered
+    language = escape(book_json.get("language") or "en")
+    title = escape(book_json["title"], quote=False)
+    identifier = escape(str(book_json["id"]))
+    # the cover page, if any, then the table of contents and the chapters
+    spine = []
+    if cover_file:
+        spine.append("cover")
+    spine.append("nav")
+    items = []
+    nav_points = []
+    links = []
+
+    with zipfile.ZipFile(
+        filename, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL
+    ) as archive:
+        # the mimetype must come first, uncompressed
+        archive.writestr(
+            zipfile.ZipInfo("mimetype"), MIMETYPE,
+            compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER_XML)
+        archive.writestr("EPUB/style/nav.css", css)
+        if cover_file:
+            archive.write(
+                cover_file, "EPUB/images/cover.jpg",
+                compress_type=zipfile.ZIP_STORED)
+            archive.writestr("EPUB/cover.xhtml", XHTML_TEMPLATE.render({
+                "language": language,
+                "title": title,
+                "body": COVER_BODY_TEMPLATE.render({"title": escape(
+                    book_json["title"])}),
+            }))
+
+        for index, chapter_json in enumerate(book_json["chapters"]):
+            chapter_id = f"chapter_{index}"
+            href = get_chapter_href(chapter_json)
+            archive.writestr(
+                f"EPUB/{href}", render_chapter(chapter_json, language))
+            chapter_title = escape(
+                chapter_json.get("title") or "", quote=False)
+            items.append(
+                ITEM_TEMPLATE.render({"href": href, "id": chapter_id}))
+            spine.append(chapter_id)
+            nav_points.append(NAV_POINT_TEMPLATE.render({
+                "id": chapter_id,
+                "play_order": str(index + 1),
+                "title": chapter_title,
+                "href": href,
+            }))
+            links.append(NAV_LINK_TEMPLATE.render(
+                {"href": href, "title": chapter_title}))
+
+        archive.writestr("EPUB/nav.xhtml", XHTML_TEMPLATE.render({
+            "language": language,
+            "title": title,
+            "body": NAV_BODY_TEMPLATE.render(
+                {"title": title, "links": "".join(links)}),
+        }))
+        archive.writestr("EPUB/toc.ncx", NCX_TEMPLATE.render({
+            "identifier": identifier,
+            "title": title,
+            "nav_points": "".join(nav_points),
+        }))
+        archive.writestr("EPUB/content.opf", PACKAGE_TEMPLATE.render({
+            "modified": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "identifier": identifier,
+            "title": title,
+            "language": language,
+            "author": escape(book_json.get("author") or "", quote=False),
+            "description": escape(
+                book_json.get("about_the_book") or "", quote=False),
+            "cover_meta": COVER_META if cover_file else "",
+            "items": (COVER_ITEMS if cover_file else "") + "".join(items),
+            "itemrefs": "".join(
+                ITEMREF_TEMPLATE.render({"id": item_id})
+                for item_id in spine),
+        }))
+
+
+def write_epub(epub_file, book_json, css="", cover_file=None):
+    """
+    Writes 'book_json' as an EPUB 3 file, with 'css' as its stylesheet and
+    the jpeg 'cover_file' as its cover, if given.
+
+    The epub is written to a temporary file that only replaces 'epub_file'
+    once complete, and is removed if writing it fails.
+    """
+    with replacing(epub_file) as tmp_file:
+        write_archive(tmp_file, book_json, css, cover_file)
+    return epub_file
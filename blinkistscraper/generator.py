@@ -1,5 +1,8 @@
 import os
-from ebooklib import epub
+import json
+import time
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # from utils import *
 from utils import get_book_pretty_filename
@@ -8,128 +11,240 @@ from utils import is_installed
 from utils import get_or_read_json
 # from utils import get_book_short_pretty_filename
 
+import catalog
+import covers
+import dumps
+import epubwriter
 import logger
+import metrics
+import template
 
 log = logger.get(f"blinkistscraper.{__name__}")
 
 
+# the templates each output format is generated from
+OUTPUT_TEMPLATES = {
+    "html": ["book.html", "chapter.html"],
+    "epub": ["epub.css"],
+    "pdf": ["book.html", "chapter.html"],
+}
+
+
+def get_input_hash(format, dump_hash, cover=False):
+    # hash of everything an output is generated from, including whether it
+    # has a cover (for the epubs, which take it from the covers cache)
+    parts = [format, dump_hash or ""] + [
+        template.get_hash(name) for name in OUTPUT_TEMPLATES[format]
+    ]
+    if cover:
+        parts.append("cover")
+    return catalog.get_content_hash("\n".join(parts))
+
+
+def get_book_dump_hash(book_json):
+    dump_hash = catalog.get_dump_hash(book_json["slug"])
+    if not dump_hash:
+        # the book was never dumped, hash its data directly
+        dump_hash = catalog.get_content_hash(
+            json.dumps(book_json, sort_keys=True))
+    return dump_hash
+
+
+def get_book_input_hash(book_json, format):
+    return get_input_hash(format, get_book_dump_hash(book_json))
+
+
+def is_output_stale(
+    book_json, format, output_file, input_hash, fresh_hashes=None
+):
+    # 'fresh_hashes' are the input hashes of an up to date output, if there
+    # are others than 'input_hash'
+    if not os.path.exists(output_file):
+        return True
+    recorded_hash = catalog.get_output_hash(book_json["slug"], format)
+    if recorded_hash is None:
+        # generated before its inputs were recorded, assume it's up to date
+        catalog.record_output(book_json, format, output_file, input_hash)
+        return False
+    return recorded_hash not in (fresh_hashes or [input_hash])
+
+
+def get_stale_dump_files(formats):
+    """
+    Lists the dumps of the books with outputs in 'formats' that are stale
+    (generated from a different dump or templates), missing, or were never
+    generated.
+    """
+    stale_files = []
+    for slug, dump_file, dump_hash, outputs in catalog.get_outputs(formats):
+        for format in formats:
+            if format not in outputs:
+                stale_files.append(dump_file)
+                break
+            output_file, recorded_hash = outputs[format]
+            if not os.path.exists(output_file):
+                stale_files.append(dump_file)
+                break
+            # whether an epub's cover is cached can't be told from the
+            # catalog: it is checked again when the epub gets generated
+            fresh_hashes = [
+                get_input_hash(format, dump_hash, cover)
+                for cover in ([False, True] if format == "epub" else [False])
+            ]
+            if recorded_hash and recorded_hash not in fresh_hashes:
+                stale_files.append(dump_file)
+                break
+    return stale_files
+
+
+def generate_book_outputs(
+    book_json_or_file, html=True, epub=True, pdf=False, cover_img_file=False
+):
+    book_json = get_or_read_json(book_json_or_file)
+    if html:
+        generate_book_html(book_json, cover_img_file)
+    if epub:
+        generate_book_epub(book_json, cover_img_file)
+    if pdf:
+        generate_book_pdf(book_json, cover_img_file)
+    return book_json["slug"]
+
+
+def generate_book_outputs_with_metrics(book_json_or_file, **kwargs):
+    # worker processes hand their metrics over with the result, for the main
+    # process to merge them with its own
+    slug = generate_book_outputs(book_json_or_file, **kwargs)
+    return slug, metrics.collect()
+
+
+def initialize_worker(verbose):
+    # worker processes don't inherit the logger verbosity on every platform
+    logger.set_verbose(logger.get("blinkistscraper"), verbose)
+
+
+def generate_books(files, jobs, verbose=False, **kwargs):
+    """
+    Generates the outputs for every dump in 'files' over a pool of 'jobs'
+    worker processes, logging progress and failures for each book.
+
+    Extra keyword arguments are passed to generate_book_outputs. Returns the
+    list of files whose outputs were generated successfully.
+    """
+    processed_files = []
+    failed_files = []
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=initialize_worker, initargs=(verbose,)
+    ) as executor:
+        futures = {
+            executor.submit(
+                generate_book_outputs_with_metrics, file, **kwargs
+            ): file
+            for file in files
+        }
+        for count, future in enumerate(as_completed(futures), start=1):
+            file = futures[future]
+            try:
+                slug, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                processed_files.append(file)
+                log.info(f"[{count}/{len(futures)}] Processed {slug}")
+            except Exception as e:
+                failed_files.append(file)
+                log.error(f"[{count}/{len(futures)}] Failed processing "
+                          f"{file}: {e}")
+    if failed_files:
+        log.warning(
+            f"Failed processing {len(failed_files)} book"
+            f"{'s' if len(failed_files) != 1 else ''}: "
+            f"{', '.join(failed_files)}"
+        )
+    return processed_files
+
+
 def generate_book_html(book_json_or_file, cover_img_file=False):
     book_json = get_or_read_json(book_json_or_file)
     filepath = get_book_pretty_filepath(book_json)
     filename = get_book_pretty_filename(book_json, ".html")
     html_file = os.path.join(filepath, filename)
-    if os.path.exists(html_file):
-        log.debug(f"Html file for {book_json['slug']} already exists, not "
+    input_hash = get_book_input_hash(book_json, "html")
+    if not is_output_stale(book_json, "html", html_file, input_hash):
+        log.debug(f"Html file for {book_json['slug']} is up to date, not "
                   "generating...")
         return html_file
     log.info(f"Generating .html for {book_json['slug']}")
+    start = time.perf_counter()
+    book_json = dumps.load_book_content(book_json)
 
-    # open the book html template and replace every occurency of {{key}}
+    # render the book html template, replacing every occurency of {key}
     # with the relevant parameter from the json file
-    book_template_file = open(
-        os.path.join(os.getcwd(), "templates", "book.html"), "r")
-    book_template = book_template_file.read()
-    book_html = book_template
-    for key in book_json:
-        book_html = book_html.replace(f"{{{key}}}", str(book_json[key]))
+    book_template = template.get_template("book.html")
+    book_values = {key: str(value) for key, value in book_json.items()}
+
+    # when the special tag {__chapters__} is found, render the chapter
+    # template for each chapter in the same fashion, then add the chapters'
+    # html into the book's html
+    if book_template.has("__chapters__"):
+        chapter_template = template.get_template("chapter.html")
+        chapters_html = []
+        for chapter_json in book_json["chapters"]:
+            # sanitize null keys (e.g. supplement)
+            chapter_values = {
+                key: str(value) if value else ""
+                for key, value in chapter_json.items()
+            }
+            chapters_html.append(chapter_template.render(chapter_values))
+        book_values["__chapters__"] = "\n".join(chapters_html)
+
+    book_html = book_template.render(book_values)
 
     if cover_img_file:
-        # replace the online (https://blinkist) URL with a local (/.jpg) one
+        # replace the online (https://blinkist) URL with a local (/.jpg) one,
+        # relative to the html file
         cover_img_url = book_json["image_url"]
-        book_html = book_html.replace(cover_img_url, cover_img_file)
+        book_html = book_html.replace(
+            cover_img_url, os.path.relpath(cover_img_file, filepath))
 
-    # when the special tag {__chapters__} is found, open the chapter template
-    # file and do the same, then add the template chapter's html into the
-    # book's html
-    if "{__chapters__}" in book_template:
-        chapters_html = []
-        chapter_template_file = open(
-            os.path.join(os.getcwd(), "templates", "chapter.html"), "r"
-        )
-        chapter_template = chapter_template_file.read()
-        for chapter_json in book_json["chapters"]:
-            chapter_html = chapter_template
-            for chapter_key in chapter_json:
-                # sanitize null keys (e.g. supplement)
-                if not chapter_json[chapter_key]:
-                    chapter_json[chapter_key] = ""
-                chapter_html = chapter_html.replace(
-                    f"{{{chapter_key}}}", str(chapter_json[chapter_key])
-                )
-            chapters_html.append(chapter_html)
-
-    book_html = book_html.replace("{__chapters__}", "\n".join(chapters_html))
     book_html = book_html.replace("<p>&nbsp;</p>", "")
 
     # finally, export the finished book html
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
+    os.makedirs(filepath, exist_ok=True)
     with open(html_file, "w", encoding="utf-8") as outfile:
         outfile.write(book_html)
+    catalog.record_output(book_json, "html", html_file, input_hash)
+    metrics.observe("generate_html", time.perf_counter() - start)
     return html_file
 
 
-def generate_book_epub(book_json_or_file):
+def generate_book_epub(book_json_or_file, cover_img_file=False):
     book_json = get_or_read_json(book_json_or_file)
     filepath = get_book_pretty_filepath(book_json)
     filename = get_book_pretty_filename(book_json, ".epub")
     epub_file = os.path.join(filepath, filename)
-    if os.path.exists(epub_file):
-        log.debug(f"Epub file for {book_json['slug']} already exists, not "
+    # the cover saved with the book, or one fetched earlier, as the
+    # generators don't download anything
+    if not cover_img_file:
+        cover_img_file = covers.find_cover(book_json)
+    dump_hash = get_book_dump_hash(book_json)
+    input_hash = get_input_hash("epub", dump_hash, cover=bool(cover_img_file))
+    # an epub without a cover is generated again once its cover is fetched,
+    # but one with a cover stays up to date if the cover leaves the cache
+    fresh_hashes = [input_hash, get_input_hash("epub", dump_hash, cover=True)]
+    if not is_output_stale(
+        book_json, "epub", epub_file, input_hash, fresh_hashes
+    ):
+        log.debug(f"Epub file for {book_json['slug']} is up to date, not "
                   "generating...")
         return epub_file
     log.info(f"Generating .epub for {book_json['slug']}")
-    book = epub.EpubBook()
-
-    # set metadata
-    book.set_identifier(book_json["id"])
-    book.set_title(book_json["title"])
-    book.set_language("en")
-    book.add_author(book_json["author"])
-    book.add_metadata("DC", "description", book_json["about_the_book"])
-
-    # add chapters
-    chapters = []
-    # to-do: add who is this for / intro section with cover image
-    for chapter_json in book_json["chapters"]:
-        chapter = epub.EpubHtml(
-            title=chapter_json["title"],
-            file_name=f"chapter_{chapter_json['order_no']}.xhtml",
-            lang="hr",
-        )
-
-        title = chapter_json.get("title")
-        content = chapter_json.get("content")
-        supplement = chapter_json.get("supplement") or ""
-
-        chapter.content = f"<h2>{title}</h2>" + content + supplement
-
-        book.add_item(chapter)
-        chapters.append(chapter)
-
-    # define Table Of Contents
-    book.toc = chapters
-
-    # add default NCX and Nav file
-    book.add_item(epub.EpubNcx())
-    book.add_item(epub.EpubNav())
-
-    # define CSS style
-    style = open(
-        os.path.join(os.getcwd(), "templates", "epub.css"), "r").read()
-    nav_css = epub.EpubItem(
-        uid="style_nav", file_name="style/nav.css", media_type="text/css",
-        content=style
-    )
-    book.add_item(nav_css)
-
-    # basic spine
-    book.spine = ["nav"] + chapters
-
-    # write to the file
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
-    epub.write_epub(epub_file, book, {})
+    start = time.perf_counter()
+    book_json = dumps.load_book_content(book_json)
+
+    os.makedirs(filepath, exist_ok=True)
+    epubwriter.write_epub(
+        epub_file, book_json, css=template.get_text("epub.css"),
+        cover_file=cover_img_file)
+    catalog.record_output(book_json, "epub", epub_file, input_hash)
+    metrics.observe("generate_epub", time.perf_counter() - start)
     return epub_file
 
 
@@ -145,22 +260,21 @@ def generate_book_pdf(book_json_or_file, cover_img_file=False):
     filepath = get_book_pretty_filepath(book_json)
     filename = get_book_pretty_filename(book_json, ".pdf")
     pdf_file = os.path.join(filepath, filename)
-    if os.path.exists(pdf_file):
-        log.debug(f"Pdf file for {book_json['slug']} already exists, not "
+    input_hash = get_book_input_hash(book_json, "pdf")
+    if not is_output_stale(book_json, "pdf", pdf_file, input_hash):
+        log.debug(f"Pdf file for {book_json['slug']} is up to date, not "
                   "generating...")
         return pdf_file
 
-    # generates the html file if it doesn't already exists
-    html_file = os.path.join(
-        get_book_pretty_filepath(book_json),
-        get_book_pretty_filename(book_json, ".html")
-    )
-    if not os.path.exists(html_file):
-        generate_book_html(book_json_or_file, cover_img_file)
+    # generates the html file if it doesn't already exists, or is stale
+    html_file = generate_book_html(book_json, cover_img_file)
 
     log.debug(f"Generating .pdf for {book_json['slug']}")
     pdf_command = f'wkhtmltopdf --quiet "{html_file}" "{pdf_file}"'
-    os.system(pdf_command)
+    with metrics.timed("generate_pdf"):
+        os.system(pdf_command)
+    if os.path.exists(pdf_file):
+        catalog.record_output(book_json, "pdf", pdf_file, input_hash)
     return pdf_file
 
 
@@ -177,8 +291,9 @@ def combine_audio(book_json, files, keep_blinks=False, cover_img_file=False):
     filename = get_book_pretty_filename(book_json, ".m4a")
 
     files_list = os.path.abspath(os.path.join(filepath, "temp.txt"))
-    combined_audio_file = os.path.abspath(os.path.join(filepath, "concat.m4a"))
     tagged_audio_file = os.path.abspath(os.path.join(filepath, filename))
+    # ffmpeg picks the output format from the extension, so keep it last
+    tmp_audio_file = os.path.abspath(os.path.join(filepath, "_concat.m4a"))
 
     # ffmpeg fails on windows if the output filepath is longer than 260 chars
     # if len(tagged_audio_file) >= 260:
@@ -197,37 +312,51 @@ def combine_audio(book_json, files, keep_blinks=False, cover_img_file=False):
             # escape any quotes for the ffmpeg concat's command file list
             sanitized_file = os.path.abspath(file).replace("'", "'\\''")
             outfile.write(f"file '{sanitized_file}'\n")
-    silent = "-nostats -loglevel 0 -y"
-    concat_command = (
-        f'ffmpeg {silent} -f concat -safe 0 -i "{files_list}" -c copy '
-        f'"{combined_audio_file}"')
-    os.system(concat_command)
+
+    # concatenate, tag and embed the cover in a single pass, into a temporary
+    # file that is only renamed once ffmpeg succeeded
+    ffmpeg_command = [
+        "ffmpeg", "-nostats", "-loglevel", "error", "-y",
+        "-f", "concat", "-safe", "0", "-i", files_list,
+    ]
     if cover_img_file:
-        cover_embed = (
-            f'-i "{cover_img_file}" -map 0 -map 1 -disposition:v:0 '
-            'attached_pic')
-    else:
-        cover_embed = ""
-    title_metadata = f"-metadata title=\"{book_json['title']}\""
-    author_metadata = f"-metadata artist=\"{book_json['author']}\""
-    category_metadata = f"-metadata album=\"{book_json['category']}\""
-    genre_metadata = '-metadata genre="Blinkist"'
-    tag_command = (
-        f'ffmpeg {silent} -i "{combined_audio_file}" {cover_embed} -c copy '
-        f"{title_metadata} {author_metadata} "
-        f"{category_metadata} {genre_metadata}"
-    )
-    tag_command += f' "{tagged_audio_file}"'
-    os.system(tag_command)
-
-    # clean up files
-    if os.path.exists(files_list):
-        os.remove(files_list)
-    if os.path.exists(combined_audio_file):
-        os.remove(combined_audio_file)
+        ffmpeg_command += [
+            "-i", cover_img_file, "-map", "0", "-map", "1",
+            "-disposition:v:0", "attached_pic",
+        ]
+    ffmpeg_command += [
+        "-c", "copy",
+        "-metadata", f"title={book_json['title']}",
+        "-metadata", f"artist={book_json['author']}",
+        "-metadata", f"album={book_json['category']}",
+        "-metadata", "genre=Blinkist",
+        tmp_audio_file,
+    ]
+    try:
+        with metrics.timed("ffmpeg"):
+            result = subprocess.run(
+                ffmpeg_command, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        if result.returncode != 0:
+            log.error(
+                f"ffmpeg failed combining audio files for {book_json['slug']} "
+                f"(exit code {result.returncode}): "
+                f"{result.stderr.decode('utf-8', 'replace').strip()}"
+            )
+            return
+        os.replace(tmp_audio_file, tagged_audio_file)
+    finally:
+        # clean up files
+        for tmp_file in [files_list, tmp_audio_file]:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
     if not (keep_blinks):
         log.debug(
             f"Cleaning up individual audio files for {book_json['slug']}")
         for file in files:
             if os.path.exists(file):
                 os.remove(os.path.abspath(file))
+
+    return tagged_audio_file
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import logger
+import ratelimit
+from utils import read_cached, write_cached
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+SITE_URL = "https://www.blinkist.com"
+API_URL = "https://api.blinkist.com"
+CACHE_DIR = os.path.join("cache", "http")
+TIMEOUT = (10, 60)
+TOO_MANY_REQUESTS_RETRIES = 3
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def set_site_url(url):
+    # point the scraper to another site, e.g. a local stand-in server
+    global SITE_URL
+    SITE_URL = url.rstrip("/")
+
+
+def get_site_url(path):
+    return SITE_URL + path
+
+
+def set_api_url(url):
+    # point the api calls somewhere else, e.g. to a local fake api server
+    global API_URL
+    API_URL = url.rstrip("/")
+
+
+def get_api_url(path):
+    return API_URL + path
+
+
+def get_session():
+    # a single session is shared by every thread, so that connections to the
+    # same host are pooled and kept alive between books
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504],
+            )
+            adapter = HTTPAdapter(
+                pool_connections=8, pool_maxsize=16, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_retry_after(response):
+    # only the number of seconds form of the header is supported
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get(url, **kwargs):
+    """
+    Gets 'url' with the shared session, throttled by the adaptive rate
+    limiter of its host, which is told how the host responded. Requests
+    answered with '429 Too Many Requests' are sent again (up to
+    TOO_MANY_REQUESTS_RETRIES times) once the limiter slowed down.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    limiter = ratelimit.get_limiter(url)
+    for attempt in range(TOO_MANY_REQUESTS_RETRIES + 1):
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = get_session().get(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            limiter.backoff(type(e).__name__)
+            raise
+        elapsed = time.monotonic() - start
+        if response.status_code == 429:
+            limiter.backoff("HTTP 429", get_retry_after(response))
+            if attempt < TOO_MANY_REQUESTS_RETRIES:
+                response.close()
+                continue
+        elif response.status_code >= 500:
+            limiter.backoff(f"HTTP {response.status_code}")
+        else:
+            limiter.success(elapsed)
+        return response
+
+
+def write_cached_response(url, response):
+    write_cached(CACHE_DIR, url, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "body": response.text,
+    })
+
+
+def get_json(url, use_cache=True):
+    """
+    Gets the json content at 'url'.
+
+    If a previous response for 'url' carried an ETag or Last-Modified header,
+    it is kept in the on-disk cache and the request is sent as a conditional
+    one: a '304 Not Modified' answer is then served from the cache.
+    """
+    headers = {}
+    cached = read_cached(CACHE_DIR, url) if use_cache else None
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = get(url, headers=headers)
+    if cached and response.status_code == 304:
+        log.debug(f"{url} not modified, using cached response")
+        return json.loads(cached["body"])
+    response.raise_for_status()
+
+    if use_cache and (
+        response.headers.get("ETag") or response.headers.get("Last-Modified")
+    ):
+        write_cached_response(url, response)
+    return response.json()
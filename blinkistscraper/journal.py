@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+
+import logger
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+JOURNAL_FILE = "journal.jsonl"
+
+# the states a book goes through during a run
+SCRAPED = "scraped"
+AUDIO = "audio"
+COMBINED = "combined"
+NO_AUDIO = "no_audio"
+GENERATED = "generated"
+
+
+class Journal:
+    """
+    An append-only log of a scrape run, one json event per line: the run's
+    work plan (the categories, and the books listed in each of them and in
+    the sitemap) and the states each book went through.
+
+    Every event is flushed as soon as it is recorded, so that after a crash
+    or an interruption, the journal tells exactly what was left to do. A
+    truncated last line (written while crashing) is ignored when reading it.
+
+    The run's options (the arguments deciding which books get listed) are
+    recorded with it, and a run can only be resumed with the same ones.
+    """
+
+    def __init__(self, filename=JOURNAL_FILE):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.file = None
+        self.loaded = False
+        self.options = None
+        self.categories = None
+        self.plans = {}
+        self.states = {}
+        self.completed = False
+
+    def check_options(self, options):
+        """
+        Raises ValueError if the last run, unless it completed, was started
+        with other 'options' than these.
+        """
+        if not self.loaded and os.path.exists(self.filename):
+            self.load()
+        if self.completed or not self.loaded:
+            return
+        if self.options is None:
+            log.warning(
+                "The last run did not record its arguments, make sure to "
+                "resume it with the same ones")
+            return
+        changed = [
+            "--" + name.replace("_", "-")
+            for name in sorted(set(options) | set(self.options))
+            if options.get(name) != self.options.get(name)
+        ]
+        if changed:
+            raise ValueError(
+                f"the last run was started with other {', '.join(changed)}: "
+                "resume it with the same arguments, or start a new run "
+                "without --resume")
+
+    def open(self, resume=False, options=None):
+        """
+        Starts journaling a new run with 'options', or continues the journal
+        of the last one if 'resume' is set (see check_options). Returns
+        whether there was a run to resume.
+        """
+        resumed = False
+        if resume and os.path.exists(self.filename):
+            self.check_options(options or {})
+            if self.completed:
+                log.info("The last run completed, starting a new one")
+            else:
+                resumed = True
+        if not resumed:
+            self.options = options
+            self.categories = None
+            self.plans = {}
+            self.states = {}
+        self.completed = False
+        self.file = open(
+            self.filename, "a" if resumed else "w", encoding="utf-8")
+        if resumed and self.file.tell() and not self.ends_with_newline():
+            # end the truncated last line, so it doesn't swallow the next
+            self.file.write("\n")
+        if not resumed:
+            self.append({
+                "event": "run", "started_at": time.time(), "options": options})
+        else:
+            finished = sum(
+                1 for states in self.states.values() if GENERATED in states)
+            log.info(
+                f"Resuming the last run: {len(self.plans)} listing"
+                f"{'s' if len(self.plans) != 1 else ''} and {finished} "
+                f"generated book{'s' if finished != 1 else ''} already done")
+        return resumed
+
+    def load(self):
+        with open(self.filename, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    log.debug(f"Skipping a truncated {self.filename} line")
+                    continue
+                self.apply(event)
+        self.loaded = True
+
+    def ends_with_newline(self):
+        with open(self.filename, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def apply(self, event):
+        kind = event.get("event")
+        if kind == "run":
+            # journals of older versions did not record the options
+            self.options = event.get("options")
+            self.categories = None
+            self.plans = {}
+            self.states = {}
+            self.completed = False
+        elif kind == "categories":
+            self.categories = event["categories"]
+        elif kind == "plan":
+            self.plans[event["key"]] = event["books"]
+        elif kind == "book":
+            self.states.setdefault(event["slug"], set()).add(event["state"])
+        elif kind == "done":
+            self.completed = True
+
+    def append(self, event):
+        with self.lock:
+            if not self.file:
+                return
+            self.apply(event)
+            self.file.write(json.dumps(event) + "\n")
+            self.file.flush()
+
+    def record_categories(self, categories):
+        self.append({"event": "categories", "categories": categories})
+
+    def get_plan(self, key):
+        # the books listed under 'key' in this run, or None if not yet listed
+        return self.plans.get(key)
+
+    def record_plan(self, key, books_urls):
+        self.append({"event": "plan", "key": key, "books": books_urls})
+
+    def record(self, slug, state):
+        self.append({"event": "book", "slug": slug, "state": state})
+
+    def is_finished(self, slug, states):
+        # whether the book went through all of 'states' (the audio ones do
+        # not apply to books without audio)
+        book_states = self.states.get(slug, set())
+        if NO_AUDIO in book_states:
+            states = set(states) - {AUDIO, COMBINED}
+        return book_states.issuperset(states)
+
+    def complete(self):
+        self.append({"event": "done", "finished_at": time.time()})
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,52 @@
+import os
+import time
+
+import logger
+from utils import read_cached, write_cached
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+LISTINGS_DIR = os.path.join("cache", "listings")
+# seconds the categories and books listings are reused for
+DEFAULT_TTL = 24 * 3600
+
+_ttl = DEFAULT_TTL
+
+
+def set_ttl(seconds):
+    # 0 never reuses a cached listing (they are still cached for next runs)
+    global _ttl
+    _ttl = seconds
+
+
+def read(key):
+    # returns the listing cached under 'key', unless missing or expired
+    if not _ttl:
+        return None
+    cached = read_cached(LISTINGS_DIR, key)
+    if cached is None:
+        return None
+    age = time.time() - cached["stored_at"]
+    if age > _ttl:
+        return None
+    log.debug(f"Using the listing of {key} cached {age / 3600:.1f}h ago")
+    return cached["value"]
+
+
+def write(key, value):
+    write_cached(
+        LISTINGS_DIR, key, {"stored_at": time.time(), "value": value})
+
+
+def get(key, fetch):
+    """
+    Returns the listing cached under 'key' if it is fresh enough, otherwise
+    calls 'fetch' to list it again, and caches the result. Empty listings are
+    never cached, as they are most likely a page that failed to load.
+    """
+    value = read(key)
+    if value is None:
+        value = fetch()
+        if value:
+            write(key, value)
+    return value
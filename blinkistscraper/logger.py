@@ -1,5 +1,7 @@
 import sys
+import time
 import logging
+import threading
 
 
 def setup(log):
@@ -66,3 +68,53 @@ def get(name):
 
 def set_verbose(log, verbose):
     log.setLevel(logging.INFO if not verbose else logging.DEBUG)
+
+
+def format_duration(seconds):
+    return "{:02d}:{:02d}:{:02d}".format(
+        int(seconds // 3600), int(seconds % 3600 // 60), int(seconds % 60))
+
+
+class Progress:
+    """
+    Logs the number of books processed so far, the books per hour and an
+    estimate of the time left, at most once every 'interval' seconds.
+
+    log -- the logger to log progress with.
+    total -- number of books expected, if known (see 'expect').
+    """
+
+    def __init__(self, log, total=0, interval=30):
+        self.log = log
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started_at = time.time()
+        self.logged_at = self.started_at
+        self.lock = threading.Lock()
+
+    def expect(self, total):
+        # the total can grow as more books are listed
+        with self.lock:
+            self.total = max(self.total, total)
+
+    def update(self, count=1):
+        with self.lock:
+            self.done += count
+            now = time.time()
+            if now - self.logged_at < self.interval and (
+                self.done < self.total
+            ):
+                return
+            self.logged_at = now
+            done, total = self.done, max(self.total, self.done)
+            elapsed = now - self.started_at
+        books_per_hour = done / elapsed * 3600 if elapsed else 0
+        message = f"Processed {done}"
+        if total:
+            message += f"/{total}"
+        message += f" books ({books_per_hour:.0f} books/hour"
+        if total and books_per_hour:
+            eta = (total - done) / books_per_hour * 3600
+            message += f", ETA {format_duration(eta)}"
+        self.log.info(message + ")")
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import logger
+from utils import atomic_open
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+METRICS_DIR = "metrics"
+PROMETHEUS_FILE = os.path.join(METRICS_DIR, "blinkistscraper.prom")
+
+# upper bounds (in seconds) of the timing histograms buckets
+BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+_started_at = time.time()
+# time each thread spent in waited blocks, left out of its timed blocks
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Timings of a stage, counted in cumulative buckets as Prometheus does:
+    each bucket counts the observations smaller than or equal to its bound.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, data):
+        self.buckets = [a + b for a, b in zip(self.buckets, data["buckets"])]
+        self.count += data["count"]
+        self.sum += data["sum"]
+        self.max = max(self.max, data["max"])
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0,
+            "max": round(self.max, 6),
+            "buckets": self.buckets,
+        }
+
+
+def observe(stage, seconds):
+    with _lock:
+        if stage not in _histograms:
+            _histograms[stage] = Histogram()
+        _histograms[stage].observe(seconds)
+
+
+def count(counter, value=1):
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + value
+
+
+def get_waited():
+    return getattr(_local, "waited", 0.0)
+
+
+@contextmanager
+def timed(stage):
+    # time the enclosed block as one observation of 'stage', even if it
+    # fails, leaving out the waited blocks it encloses
+    start = time.perf_counter()
+    waited = get_waited()
+    try:
+        yield
+    finally:
+        observe(
+            stage, time.perf_counter() - start - (get_waited() - waited))
+
+
+@contextmanager
+def waited(stage):
+    # time the enclosed block as one observation of 'stage', e.g. waiting
+    # for a rate limiter, which is not part of the timed blocks enclosing it
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.waited = get_waited() + elapsed
+        observe(stage, elapsed)
+
+
+def collect():
+    """
+    Returns the metrics recorded so far and resets them, so that worker
+    processes can hand theirs over to the main process to merge.
+    """
+    with _lock:
+        data = {
+            "stages": {
+                stage: histogram.to_dict()
+                for stage, histogram in _histograms.items()
+            },
+            "counters": dict(_counters),
+        }
+        _histograms.clear()
+        _counters.clear()
+    return data
+
+
+def merge(data):
+    with _lock:
+        for stage, histogram_data in data["stages"].items():
+            if stage not in _histograms:
+                _histograms[stage] = Histogram()
+            _histograms[stage].merge(histogram_data)
+        for counter, value in data["counters"].items():
+            _counters[counter] = _counters.get(counter, 0) + value
+
+
+def get_report():
+    with _lock:
+        stages = {
+            stage: histogram.to_dict()
+            for stage, histogram in sorted(_histograms.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    report = {
+        "started_at": time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.localtime(_started_at)),
+        "elapsed": round(time.time() - _started_at, 3),
+        "buckets": BUCKETS,
+        "stages": stages,
+        "counters": counters,
+    }
+    # throughput of the downloads, over the time spent downloading
+    download_time = stages.get("audio_download", {}).get("sum")
+    if download_time:
+        report["audio_download_bytes_per_second"] = round(
+            counters.get("audio_download_bytes", 0) / download_time)
+    return report
+
+
+def get_prometheus_text(report):
+    lines = [
+        "# HELP blinkistscraper_stage_seconds Time spent in each stage",
+        "# TYPE blinkistscraper_stage_seconds histogram",
+    ]
+    for stage, histogram in report["stages"].items():
+        for bound, bucket_count in zip(BUCKETS, histogram["buckets"]):
+            lines.append(
+                f'blinkistscraper_stage_seconds_bucket{{stage="{stage}",'
+                f'le="{bound}"}} {bucket_count}')
+        lines.append(
+            f'blinkistscraper_stage_seconds_bucket{{stage="{stage}",'
+            f'le="+Inf"}} {histogram["count"]}')
+        lines.append(
+            f'blinkistscraper_stage_seconds_sum{{stage="{stage}"}} '
+            f'{histogram["sum"]}')
+        lines.append(
+            f'blinkistscraper_stage_seconds_count{{stage="{stage}"}} '
+            f'{histogram["count"]}')
+    for counter, value in report["counters"].items():
+        lines.append(f"# TYPE blinkistscraper_{counter}_total counter")
+        lines.append(f"blinkistscraper_{counter}_total {value}")
+    lines.append("# TYPE blinkistscraper_run_seconds gauge")
+    lines.append(f"blinkistscraper_run_seconds {report['elapsed']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(filename, content):
+    # the textfile collector may read the file at any time, so never leave
+    # a partial one behind
+    # 'filename' may be in the current directory
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with atomic_open(filename) as outfile:
+        outfile.write(content)
+
+
+def write_report(prometheus_file=PROMETHEUS_FILE):
+    """
+    Writes the metrics of this run as a json report in the metrics folder,
+    and as a Prometheus textfile at 'prometheus_file'. Returns the report.
+    """
+    report = get_report()
+    report_file = os.path.join(
+        METRICS_DIR,
+        f"run-{time.strftime('%Y%m%d-%H%M%S', time.localtime(_started_at))}"
+        ".json"
+    )
+    write_file(report_file, json.dumps(report, indent=4))
+    write_file(prometheus_file, get_prometheus_text(report))
+    log.debug(f"Wrote run metrics to {report_file} and {prometheus_file}")
+    return report
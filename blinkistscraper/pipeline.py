@@ -0,0 +1,116 @@
+import queue
+import threading
+
+import logger
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+
+class Stage:
+    """
+    A pipeline stage: a pool of worker threads consuming a bounded queue.
+
+    Putting an item on a full stage blocks, so a slow stage throttles the
+    ones feeding it instead of letting work pile up in memory.
+
+    name -- the stage name, used for logging.
+    handle -- callable processing a single item.
+    workers -- number of worker threads.
+    maxsize -- number of items that can wait in the queue.
+    """
+
+    def __init__(self, name, handle, workers=1, maxsize=None):
+        self.name = name
+        self.handle = handle
+        self.items = queue.Queue(maxsize or workers * 2)
+        self.stopped = threading.Event()
+        self.closed = False
+        self.threads = [
+            threading.Thread(
+                target=self._work, daemon=True, name=f"{name}-{i + 1}")
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, *item):
+        if self.stopped.is_set():
+            return
+        self.items.put(item)
+
+    def close(self):
+        # let the workers process every queued item, then stop them. closing
+        # a stage closed already does nothing
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.items.put(None)
+        self.join()
+
+    def stop(self):
+        # discard the queued items, so that the workers (and anyone blocked
+        # feeding this stage) can move on and stop
+        self.stopped.set()
+        try:
+            while True:
+                self.items.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.threads:
+            try:
+                self.items.put_nowait(None)
+            except queue.Full:
+                break
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while True:
+            item = self.items.get()
+            if item is None or self.stopped.is_set():
+                break
+            try:
+                self.handle(*item)
+            except Exception as e:
+                log.exception(e)
+                log.error(f"Error in the {self.name} stage")
+
+
+class Pipeline:
+    """
+    Stages run in the order they were added: closing the pipeline waits for
+    each stage to finish before closing the next one, since a stage can feed
+    any of the stages added after it.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, handle, workers=1, maxsize=None):
+        stage = Stage(name, handle, workers, maxsize)
+        self.stages.append(stage)
+        return stage
+
+    def __getitem__(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+    def stop(self, timeout=10):
+        # stop every stage before waiting for any, as the workers of a stage
+        # may be blocked feeding the next one
+        log.info("Stopping background workers...")
+        for stage in self.stages:
+            stage.stopped.set()
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout)
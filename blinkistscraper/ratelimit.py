@@ -0,0 +1,141 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import logger
+import metrics
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket, shared between all the threads hitting the
+    same host.
+
+    rate -- tokens added to the bucket per second.
+    capacity -- maximum number of tokens the bucket can hold, i.e. how many
+                requests can be sent in a burst.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # take a token, waiting until one is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    A token bucket whose rate adapts to how the host responds, as TCP
+    congestion control does (AIMD): every healthy response adds 'increase'
+    requests per second to the rate, up to 'max_rate', while every sign of
+    trouble (429 and 5xx answers, slow responses, challenge or captcha pages)
+    multiplies it by 'decrease', down to 'min_rate'.
+
+    host -- the host the bucket throttles, used for logging.
+    slow_after -- seconds after which a response counts as slow.
+    """
+
+    def __init__(
+        self, host, rate, min_rate, max_rate, capacity=1, increase=None,
+        decrease=0.5, slow_after=10.0
+    ):
+        super().__init__(rate, capacity)
+        self.host = host
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase or max_rate / 50
+        self.decrease = decrease
+        self.slow_after = slow_after
+        # no request is sent before then, e.g. as asked by a Retry-After
+        self.paused_until = 0
+
+    def acquire(self):
+        # the time spent waiting is reported apart from the requests' own
+        with metrics.waited("rate_limit_wait"):
+            while True:
+                with self.lock:
+                    wait = self.paused_until - time.monotonic()
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+            super().acquire()
+
+    def success(self, elapsed=0):
+        if elapsed > self.slow_after:
+            self.backoff(f"slow response ({elapsed:.1f}s)")
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def backoff(self, reason, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # drop any saved up burst
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until, time.monotonic() + retry_after)
+            rate = self.rate
+        log.info(
+            f"Slowing down requests to {self.host} after {reason}: "
+            f"{1 / rate:.1f}s between requests"
+        )
+
+
+# limits of the hosts with no specific ones (e.g. the audio files servers)
+DEFAULT_LIMITS = {
+    "rate": 4.0, "min_rate": 0.25, "max_rate": 16.0, "capacity": 4,
+    "slow_after": 10.0,
+}
+
+_host_limits = {}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_host(url):
+    # limiters are named after the host of a url, or after any other name
+    # (e.g. for an endpoint throttled apart from the rest of its host)
+    return urlsplit(url).netloc or url
+
+
+def configure(url, **limits):
+    """
+    Sets the limits for the host of 'url' (or for the limiter named 'url'),
+    overriding the default ones (see AdaptiveTokenBucket for the accepted
+    keyword arguments).
+    """
+    host = get_host(url)
+    with _limiters_lock:
+        _host_limits[host] = dict(DEFAULT_LIMITS, **limits)
+        _limiters.pop(host, None)
+
+
+def get_limiter(url):
+    # every thread (and driver) sending requests to the same host shares
+    # the same limiter
+    host = get_host(url)
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveTokenBucket(
+                host, **_host_limits.get(host, DEFAULT_LIMITS))
+        return _limiters[host]
@@ -1,13 +1,17 @@
 import os
 import time
-import requests
 import json
+import gzip
 import pickle
 import sys
-from shutil import copyfile as copy_file
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 import chromedriver_autoinstaller
-from seleniumwire import webdriver
+from selenium import webdriver
+from seleniumwire import webdriver as wire_webdriver
 # from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from selenium.common.exceptions import ElementNotVisibleException
@@ -18,19 +22,80 @@ from selenium.webdriver.support.ui import WebDriverWait
 # from utils import *
 from utils import get_book_pretty_filepath
 from utils import get_book_dump_filename
+from utils import get_or_read_json
+from utils import get_book_slug
 from utils import sanitize_name
+from utils import atomic_open
+
+import catalog
+import dumps
+import httpclient
+import listings
+import metrics
+import ratelimit
+import sitemap
+from download import download_file
 
 import logger
 
 log = logger.get(f"blinkistscraper.{__name__}")
 
+# requests to each host (the website, the api and the audio files servers)
+# are throttled separately by adaptive rate limiters, shared by every thread
+# and driver. this is the longest delay between requests to the website
+MAX_COOLDOWN = 60
+# the audio endpoint is served by the website, but throttled apart from its
+# pages, for the audio blinks of a book to be fetched in parallel
+AUDIO_LIMITER = "audio endpoint"
+
+
+def configure_rate_limits(cooldown, min_cooldown, audio_workers=4):
+    """
+    Starts with 'cooldown' seconds between requests to the website, then
+    shortens the delay down to 'min_cooldown' seconds while the website
+    responds well, and lengthens it whenever the website struggles.
+
+    Requests to the audio endpoint are allowed in bursts of 'audio_workers'.
+    """
+    ratelimit.configure(
+        httpclient.get_site_url("/"),
+        rate=1 / cooldown,
+        min_rate=1 / max(MAX_COOLDOWN, cooldown),
+        max_rate=1 / min(min_cooldown, cooldown),
+        capacity=1,
+        slow_after=15.0,
+    )
+    ratelimit.configure(
+        httpclient.get_api_url("/"),
+        rate=1.0, min_rate=0.1, max_rate=4.0, capacity=2, slow_after=5.0,
+    )
+    ratelimit.configure(
+        AUDIO_LIMITER,
+        rate=2.0, min_rate=0.1, max_rate=8.0,
+        capacity=max(audio_workers, 1), slow_after=10.0,
+    )
+
+
+def load_page(driver, url):
+    # load a website page, throttled by (and reporting to) the website's
+    # rate limiter
+    limiter = ratelimit.get_limiter(url)
+    limiter.acquire()
+    start = time.monotonic()
+    driver.get(url)
+    if is_challenge_page(driver):
+        limiter.backoff("a challenge page")
+    else:
+        limiter.success(time.monotonic() - start)
+
 
 def has_login_cookies():
     return os.path.exists("cookies.pkl")
 
 
 def get_login_cookies():
-    return pickle.load(open("cookies.pkl", "rb"))
+    with open("cookies.pkl", "rb") as f:
+        return pickle.load(f)
 
 
 def load_login_cookies(driver):
@@ -42,11 +107,15 @@ def load_login_cookies(driver):
 
 
 def store_login_cookies(driver):
-    pickle.dump(driver.get_cookies(), open("cookies.pkl", "wb"))
+    # several drivers may log in at the same time, never leave a partial
+    # file
+    with atomic_open("cookies.pkl", "wb") as f:
+        pickle.dump(driver.get_cookies(), f)
 
 
 def initialize_driver(
-    headless=True, with_ublock=False, no_sandbox=False, chromedriver_path=None
+    headless=True, with_ublock=False, no_sandbox=False, chromedriver_path=None,
+    with_interception=False
 ):
 
     if not chromedriver_path:
@@ -95,14 +164,28 @@ def initialize_driver(
     if not (os.path.isdir(logs_path)):
         os.makedirs(logs_path)
 
-    driver = webdriver.Chrome(
-        executable_path=chromedriver_path,
-        service_log_path=os.path.join(logs_path, "webdrive.log"),
-        # Don't verify self-signed cert, should help with 502 errors
-        # (https://github.com/wkeeling/selenium-wire/issues/55)
-        # seleniumwire_options={"verify_ssl": False},
-        options=chrome_options,
-    )
+    if with_interception:
+        # chrome never sends requests to localhost through a proxy, which
+        # would leave selenium-wire blind when scraping a local stand-in site
+        chrome_options.add_argument("--proxy-bypass-list=<-loopback>")
+        # selenium-wire is only needed to capture the audio requests. it
+        # routes every request through its proxy, but only stores the ones
+        # in scope, so keep the scope empty until audio is captured
+        driver = wire_webdriver.Chrome(
+            executable_path=chromedriver_path,
+            service_log_path=os.path.join(logs_path, "webdrive.log"),
+            # Don't verify self-signed cert, should help with 502 errors
+            # (https://github.com/wkeeling/selenium-wire/issues/55)
+            # seleniumwire_options={"verify_ssl": False},
+            options=chrome_options,
+        )
+        driver.scopes = [NO_REQUESTS_SCOPE]
+    else:
+        driver = webdriver.Chrome(
+            executable_path=chromedriver_path,
+            service_log_path=os.path.join(logs_path, "webdrive.log"),
+            options=chrome_options,
+        )
 
     driver.execute_cdp_cmd(
         "Network.setUserAgentOverride",
@@ -158,7 +241,7 @@ def initialize_driver(
 
 def login(driver, language, email, password):
     # we need to navigate to a page first in order to load eventual cookies
-    driver.get(f"https://www.blinkist.com/{language}/nc/login")
+    driver.get(httpclient.get_site_url(f"/{language}/nc/login"))
     is_logged_in = False
 
     # if we have any stored login cookie, load them into the driver
@@ -174,6 +257,8 @@ def login(driver, language, email, password):
         )
     except TimeoutException as ex:
         log.info("Please solve captcha to proceed!")
+        ratelimit.get_limiter(httpclient.get_site_url("/")).backoff(
+            "a captcha")
 	
 	# fail if captcha not solved within 60sec
     try:
@@ -187,7 +272,7 @@ def login(driver, language, email, password):
         return False
 
     # navigate to the login page
-    sign_in_url = f"https://www.blinkist.com/{language}/nc/login"
+    sign_in_url = httpclient.get_site_url(f"/{language}/nc/login")
     driver.get(sign_in_url)
 
     # click on cookie banner, if necessary
@@ -222,7 +307,7 @@ def login(driver, language, email, password):
     try:
         log.info("Logged into Blinkist. Loading Library...")
         # try to avert the captcha page by switching the URL
-        library_url = f"https://www.blinkist.com/{language}/nc/library"
+        library_url = httpclient.get_site_url(f"/{language}/nc/library")
         if not driver.current_url.rstrip('/') == library_url:
             driver.get(library_url)
         WebDriverWait(driver, 360).until(
@@ -242,7 +327,41 @@ def login(driver, language, email, password):
 def get_categories(
     driver, language, specified_categories=None, ignored_categories=[]
 ):
-    url_with_categories = f"https://www.blinkist.com/{language}/nc/login"
+    # the categories barely change from day to day, so the whole list is
+    # cached (see the listings module), and only filtered afterwards
+    categories = listings.get(
+        f"categories/{language}", lambda: list_categories(driver, language))
+    if categories is None:
+        return
+    categories_links = []
+    for category in categories:
+        label = category["label"]
+        # Do not add this category if specific_categories is specified AND
+        # the label doesn't contain anything specified there
+        if specified_categories:
+            if not list(
+                filter(
+                    lambda oc: oc.lower() in label.lower(),
+                    specified_categories
+                )
+            ):
+                continue
+        # Do not add this category if the label contains any strings from
+        # ignored_categories
+        if list(
+            filter(lambda ic: ic.lower() in label.lower(), ignored_categories)
+        ):
+            continue
+        categories_links.append(category)
+    log.info(
+        "Scraping categories: "
+        f"{', '.join([c['label'] for c in categories_links])}"
+    )
+    return categories_links
+
+
+def list_categories(driver, language):
+    url_with_categories = httpclient.get_site_url(f"/{language}/nc/login")
     driver.get(url_with_categories)
     categories_links = []
 
@@ -300,67 +419,66 @@ def get_categories(
         href = link.get_attribute("href")
         label = link.find_element_by_tag_name("span").get_attribute(
             "innerHTML")
-
-        # Do not add this category if specific_categories is specified AND
-        # the label doesn't contain anything specified there
-        if specified_categories:
-            if not list(
-                filter(
-                    lambda oc: oc.lower() in label.lower(),
-                    specified_categories
-                )
-            ):
-                continue
-        # Do not add this category if the label contains any strings from
-        # ignored_categories
-        if list(
-            filter(lambda ic: ic.lower() in label.lower(), ignored_categories)
-        ):
-            continue
-
         category = {
             "label": " ".join(label.split()).replace("&amp;", "&"), "url": href
         }
         categories_links.append(category)
-    log.info(
-        "Scraping categories: "
-        f"{', '.join([c['label'] for c in categories_links])}"
-    )
     return categories_links
 
 
 def get_all_books_for_categories(driver, category):
     log.info(f"Getting all books for category {category['label']}...")
+    books_links = listings.get(
+        f"category-books/{category['url']}",
+        lambda: list_category_books(driver, category),
+    )
+    log.info(f"Found {len(books_links)} books")
+    return books_links
+
+
+def list_category_books(driver, category):
     books_links = []
-    driver.get(category["url"] + "/books")
+    load_page(driver, category["url"] + "/books")
     books_items = driver.find_elements_by_class_name("letter-book-list__item")
     for item in books_items:
         href = item.get_attribute("href")
         books_links.append(href)
-    log.info(f"Found {len(books_links)} books")
     return books_links
 
 
 def get_all_books(driver, match_language):
     log.info("Getting all Blinkist books from sitemap...")
+    # the sitemap is a plain html page, so fetch it over HTTP first and only
+    # fall back on the browser if that fails (e.g. blocked by Cloudflare)
+    try:
+        all_books_links = sitemap.get_all_books(match_language)
+        if all_books_links:
+            log.info(f"Found {len(all_books_links)} books")
+            return all_books_links
+        log.warning("No books found in the sitemap, retrying in the browser")
+    except Exception as e:
+        log.warning(f"Could not fetch the sitemap ({e}), retrying in the "
+                    "browser")
+
     all_books_links = []
-    driver.get("https://www.blinkist.com/en/sitemap")
+    driver.get(httpclient.get_site_url(sitemap.SITEMAP_PATH))
 
+    # every language is listed, for the snapshot to keep them all
     selector = ".sitemap__section.sitemap__section--books a"
-    if match_language:
-        selector += f"[href$='{match_language}']"
-
     books_items = driver.find_elements_by_css_selector(selector)
 
     for item in books_items:
         href = item.get_attribute("href")
         all_books_links.append(href)
+    if all_books_links:
+        all_books_links = sitemap.record_books(
+            all_books_links, match_language)
     log.info(f"Found {len(all_books_links)} books")
     return all_books_links
 
 
 def get_daily_book_url(driver, language):
-    driver.get(f"https://www.blinkist.com/{language}/nc/daily")
+    driver.get(httpclient.get_site_url(f"/{language}/nc/daily"))
     daily_book_url = driver.find_element_by_css_selector(
         ".daily-book__infos a")
     if daily_book_url:
@@ -381,6 +499,40 @@ def detect_needs_upgrade(driver):
         exit()
 
 
+# selenium-wire scopes (regular expressions matched against the requests
+# urls) that store no request at all, and only the audio endpoint ones
+NO_REQUESTS_SCOPE = "^$"
+AUDIO_REQUESTS_SCOPE = r"/api/.*audio"
+
+# headers to send to the audio endpoint, shared by every thread
+AUDIO_HEADERS_FILE = "audio_headers.pkl"
+_audio_request_headers = None
+_audio_request_headers_condition = threading.Condition()
+# whether a thread is capturing the headers in its browser, for the others to
+# wait for them instead of capturing them too
+_capturing_audio_request_headers = False
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHALLENGE_MARKERS = [b"cf-chl", b"challenge-platform", b"cf_chl_opt"]
+# title of the Cloudflare challenge pages
+CHALLENGE_TITLES = ["Just a moment", "Attention Required"]
+
+# returns the order number and content html of every chapter and supplement
+# section on the reader page
+EXTRACT_CHAPTERS_SCRIPT = """
+return Array.from(document.querySelectorAll(".chapter")).map(
+    function (section) {
+        var content = section.querySelector(".chapter__content");
+        return {
+            order_no: parseInt(section.getAttribute("data-chapterno"), 10),
+            supplement: section.classList.contains("supplement"),
+            content: content ? content.innerHTML : null
+        };
+    }
+);
+"""
+
+
 def scrape_book_data(
     driver, book_url, match_language="", category={"label": "Uncategorized"},
     force=False
@@ -388,30 +540,33 @@ def scrape_book_data(
     # check if this book has already been dumped, unless we are forcing
     # scraping, if so return the content of the dump, alonside with a flash
     # saying it already existed
-    if os.path.exists(get_book_dump_filename(book_url)) and not force:
+    dump_file = catalog.get_dump_path(get_book_slug(book_url))
+    if dump_file and not force:
         log.debug(
             f"Json dump for book {book_url} already exists, skipping "
             "scraping...")
-        with open(get_book_dump_filename(book_url)) as f:
-            return json.load(f), True
+        metrics.count("books_from_dump")
+        return get_or_read_json(dump_file), True
 
     # if not, proceed scraping the reader page
     log.info(f"Scraping book at {book_url}")
     if "/nc/reader/" not in book_url:
         book_url = book_url.replace("/books/", "/nc/reader/")
 
-    if not driver.current_url == book_url:
-        driver.get(book_url)
+    with metrics.timed("page_load"):
+        if not driver.current_url == book_url:
+            load_page(driver, book_url)
 
-    # check for re-direct to the upgrade page
-    detect_needs_upgrade(driver)
+        # check for re-direct to the upgrade page
+        detect_needs_upgrade(driver)
 
-    reader = driver.find_element_by_class_name("reader__container")
+        reader = driver.find_element_by_class_name("reader__container")
 
     # get the book's metadata from the blinkist API using its ID
     book_id = reader.get_attribute("data-book-id")
-    book_json = requests.get(
-        url=f"https://api.blinkist.com/v4/books/{book_id}").json()
+    with metrics.timed("api_metadata"):
+        book_json = httpclient.get_json(
+            httpclient.get_api_url(f"/v4/books/{book_id}"))
     book = book_json["book"]
 
     if match_language and book["language"] != match_language:
@@ -441,39 +596,30 @@ def scrape_book_data(
     if json_needs_content:
         # scrape the chapter's content on the reader page
         # and extend the book json data by inserting the scraped content
-        # in the appropriate chapter section to get a complete data file
-        book_chapters = driver.find_elements(
-            By.CSS_SELECTOR, ".chapter.chapter")
-        for chapter in book_chapters:
-            chapter_no = chapter.get_attribute("data-chapterno")
-            chapter_content = chapter.find_element_by_class_name(
-                "chapter__content")
-            for chapter_json in book["chapters"]:
-                if chapter_json["order_no"] == int(chapter_no):
-                    chapter_json["content"] = chapter_content.get_attribute(
-                        "innerHTML")
-                    break
-
-        # look for any supplement sections
-        book_supplements = driver.find_elements(
-            By.CSS_SELECTOR, ".chapter.supplement")
-        for supplement in book_supplements:
-            chapter_no = supplement.get_attribute("data-chapterno")
-            supplement_content = chapter.find_element_by_class_name(
-                "chapter__content")
-            for chapter_json in book["chapters"]:
-                if chapter_json["order_no"] == int(chapter_no):
-                    if not chapter_json.get("supplement", None):
-                        supplement_text = supplement_content.get_attribute(
-                            "innerHTML")
-                        chapter_json["supplement"] = supplement_text
-                    break
+        # in the appropriate chapter section to get a complete data file.
+        # every chapter and supplement section is extracted by a single
+        # script, instead of several webdriver round-trips for each of them
+        with metrics.timed("chapter_extraction"):
+            sections = driver.execute_script(EXTRACT_CHAPTERS_SCRIPT)
+        chapters_by_no = {
+            chapter_json["order_no"]: chapter_json
+            for chapter_json in book["chapters"]
+        }
+        for section in sections:
+            chapter_json = chapters_by_no.get(section["order_no"])
+            if chapter_json is None or section["content"] is None:
+                continue
+            if not section["supplement"]:
+                chapter_json["content"] = section["content"]
+            elif not chapter_json.get("supplement", None):
+                chapter_json["supplement"] = section["content"]
 
     # if we are scraping by category, add it to the book metadata
     book["category"] = category["label"]
 
     # store the book json metadata for future use
     dump_book(book)
+    metrics.count("books_scraped")
 
     # return a tuple with the book json metadata, and a boolean indicating
     # whether the json dump already existed or not
@@ -481,16 +627,116 @@ def scrape_book_data(
 
 
 def dump_book(book_json):
-    # dump the book's metadata in a json file within the dump folder
+    # dump the book's metadata in a json file within the dump folder, and its
+    # chapters' content apart, in the format chosen for the dumps
     filepath = get_book_dump_filename(book_json)
-    if not os.path.exists(os.path.dirname(filepath)):
-        os.makedirs(os.path.dirname(filepath))
-    with open(filepath, "w") as outfile:
-        json.dump(book_json, outfile, indent=4)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    dumps.write_book(filepath, book_json)
+    # a dump of the same book in another format is now outdated
+    for extension in dumps.EXTENSIONS:
+        other_filepath = filepath[:-len(dumps.get_extension())] + extension
+        if other_filepath != filepath:
+            dumps.remove_book(other_filepath)
+    catalog.record_dump(book_json, filepath, catalog.get_book_hash(book_json))
     return filepath
 
 
-def scrape_book_audio(driver, book_json, language):
+class AudioAuthError(Exception):
+    """The audio endpoint rejected the request headers, or sent a challenge"""
+
+
+def scrape_book_audio(driver, book_json, language, max_workers=4):
+    audio_request_headers = get_audio_request_headers(
+        driver, book_json, language)
+    if not audio_request_headers:
+        return False
+    try:
+        return download_book_audio(
+            book_json, audio_request_headers, max_workers)
+    except AudioAuthError:
+        # try again once, with freshly captured headers (the rejected ones
+        # have been invalidated)
+        audio_request_headers = get_audio_request_headers(
+            driver, book_json, language)
+        if not audio_request_headers:
+            return False
+        return download_book_audio(
+            book_json, audio_request_headers, max_workers)
+
+
+def load_audio_request_headers():
+    if not os.path.exists(AUDIO_HEADERS_FILE):
+        return None
+    try:
+        with open(AUDIO_HEADERS_FILE, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        log.debug(f"Could not load the stored audio request headers: {e}")
+        return None
+
+
+def store_audio_request_headers(audio_request_headers):
+    with atomic_open(AUDIO_HEADERS_FILE, "wb") as f:
+        pickle.dump(audio_request_headers, f)
+
+
+def get_audio_request_headers(driver, book_json, language):
+    """
+    Returns the headers to send to the audio endpoint. They are captured
+    from the browser once, then reused for every book (and stored for the
+    next runs) until the endpoint rejects them and they are invalidated.
+
+    Only one thread captures them at a time, the others wait for its result
+    rather than capturing them as well.
+    """
+    global _audio_request_headers, _capturing_audio_request_headers
+    # check if the book actually has audio blinks
+    if not (book_json["is_audio"]):
+        log.debug(
+            f"Book {book_json['slug']} does not have audio blinks, "
+            "skipping scraping audio..."
+        )
+        return False
+
+    with _audio_request_headers_condition:
+        while True:
+            if _audio_request_headers is None:
+                _audio_request_headers = load_audio_request_headers()
+            if _audio_request_headers:
+                # never invalidated, or already captured again by another
+                # thread
+                return _audio_request_headers
+            if not _capturing_audio_request_headers:
+                _capturing_audio_request_headers = True
+                break
+            _audio_request_headers_condition.wait()
+
+    # capture them without holding the lock, which can take a while
+    audio_request_headers = False
+    try:
+        audio_request_headers = capture_audio_request_headers(
+            driver, book_json, language)
+    finally:
+        with _audio_request_headers_condition:
+            if audio_request_headers:
+                _audio_request_headers = audio_request_headers
+                store_audio_request_headers(audio_request_headers)
+            _capturing_audio_request_headers = False
+            _audio_request_headers_condition.notify_all()
+    return audio_request_headers
+
+
+def invalidate_audio_request_headers(audio_request_headers):
+    # forget the headers, unless they have already been refreshed meanwhile
+    global _audio_request_headers
+    with _audio_request_headers_condition:
+        if _audio_request_headers == audio_request_headers:
+            _audio_request_headers = False
+            if os.path.exists(AUDIO_HEADERS_FILE):
+                os.remove(AUDIO_HEADERS_FILE)
+
+
+def capture_audio_request_headers(driver, book_json, language):
     # check if the book actually has audio blinks
     if not (book_json["is_audio"]):
         log.debug(
@@ -499,15 +745,20 @@ def scrape_book_audio(driver, book_json, language):
         )
         return False
 
-    # clear out previous captured requests and restrict scope to the blinkist
-    # site
+    if not hasattr(driver, "wait_for_request"):
+        log.error("The driver was not started with request interception, "
+                  "can't capture the audio requests")
+        return False
+
+    # clear out previous captured requests and restrict scope to the audio
+    # endpoint, for as long as it takes to capture a request to it
     del driver.requests
-    driver.scopes = [".*blinkist.*"]
+    driver.scopes = [AUDIO_REQUESTS_SCOPE]
 
     # navigate to the book's reader page which also contains the media player
     # for the first audio blink
-    book_reader_url = (
-        f'https://www.blinkist.com/{language}/nc/reader/{book_json["slug"]}')
+    book_reader_url = httpclient.get_site_url(
+        f'/{language}/nc/reader/{book_json["slug"]}')
 
     log.info(f"Scraping book audio at {book_reader_url}")
     driver.get(book_reader_url)
@@ -519,139 +770,150 @@ def scrape_book_audio(driver, book_json, language):
     # then its headers for future requests
     try:
         captured_request = driver.wait_for_request("audio", timeout=30)
-        audio_request_headers = captured_request.headers
+        return dict(captured_request.headers)
     except TimeoutException as ex:
         log.error("Could not capture an audio endpoint request")
         log.error(str(ex))
         return False
+    finally:
+        driver.scopes = [NO_REQUESTS_SCOPE]
+        del driver.requests
+
+
+def is_challenge_page(driver):
+    title = driver.title or ""
+    return any(marker in title for marker in CHALLENGE_TITLES)
+
+
+def is_challenge(content):
+    # Cloudflare answers with an html challenge page instead of the json
+    return content.lstrip()[:1] == b"<" and any(
+        marker in content for marker in CHALLENGE_MARKERS)
 
+
+def download_book_audio(book_json, audio_request_headers, max_workers=4):
+    """
+    Downloads every audio blink of the book, returning the audio files in
+    chapter order (or an empty list on error). Raises AudioAuthError if the
+    headers need to be captured again.
+    """
+    # go through every chapter object in the book json data, resolve its
+    # audio url and download it. chapters are processed concurrently, but
+    # requests to each host are throttled by the shared adaptive limiters
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = [
+        executor.submit(
+            scrape_chapter_audio, book_json, chapter_json,
+            audio_request_headers
+        )
+        for chapter_json in book_json["chapters"]
+    ]
+
+    # collect the downloaded files in chapter order, as expected when
+    # combining them
     audio_files = []
-    error = False
+    try:
+        for future in futures:
+            audio_files.append(future.result())
+    except AudioAuthError as e:
+        log.warning(f"Audio request headers rejected ({e}), they need to be "
+                    "captured again")
+        invalidate_audio_request_headers(audio_request_headers)
+        raise
+    except json.decoder.JSONDecodeError as e:
+        log.error(f"Received malformed json data: {e}")
+        log.warning(
+            "Could not find audio url in request, aborting audio scrape...")
+        audio_files = None
+    except KeyError:
+        log.warning(
+            "Could not find audio url in request, aborting audio scrape...")
+        audio_files = None
+    except Exception as e:
+        log.error(f"Request timed out or other unexpected error: {e}")
+        audio_files = None
+    finally:
+        # don't start downloading the remaining chapters if one failed
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    if audio_files is not None:
+        return audio_files
+    else:
+        log.error("Error processing audio url, aborting audio scrape...")
+        return []
 
+
+def scrape_chapter_audio(book_json, chapter_json, audio_request_headers):
     # using requests instead of urllib.request to fetch the audio seems to
     # trigger Cloudflare's captcha
     # see https://stackoverflow.com/questions/62684468
     # /pythons-requests-triggers-cloudflares-security-while-urllib-does-not
-    import urllib.request
-    import json
-    import gzip
-
-    # go through every chapter object in the book json data
-    # and build a request to the audio endpoint using the book and chapter ID
-    for chapter_json in book_json["chapters"]:
-        time.sleep(1.0)
-        api_url = (
-            f"https://www.blinkist.com/api/books/{book_json['id']}"
-            f"/chapters/{chapter_json['id']}/audio")
-        log.debug(f"Fetching blink audio from: {api_url}")
+    api_url = httpclient.get_site_url(
+        f"/api/books/{book_json['id']}/chapters/{chapter_json['id']}/audio")
+    limiter = ratelimit.get_limiter(AUDIO_LIMITER)
+    log.debug(f"Fetching blink audio from: {api_url}")
+    audio_request = urllib.request.Request(
+        api_url, headers=audio_request_headers)
+    for attempt in range(httpclient.TOO_MANY_REQUESTS_RETRIES + 1):
+        limiter.acquire()
+        start = time.monotonic()
         try:
-            audio_request = urllib.request.Request(
-                api_url, headers=audio_request_headers)
-            audio_request_content = urllib.request.urlopen(
-                audio_request).read()
-            audio_request_json = json.loads(
-                gzip.decompress(audio_request_content).decode("utf-8")
-            )
-            if "url" in audio_request_json:
-                audio_url = audio_request_json["url"]
-                audio_file = download_book_chapter_audio(
-                    book_json, chapter_json["order_no"], audio_url
-                )
-                audio_files.append(audio_file)
-            else:
-                log.warning(
-                    "Could not find audio url in request, aborting audio "
-                    "scrape..."
-                )
-                error = True
-                break
-        except json.decoder.JSONDecodeError:
-            log.error(f"Received malformed json data: {audio_request.text}")
-            log.warning(
-                "Could not find audio url in request, aborting audio "
-                "scrape...")
-            error = True
-            break
-        except Exception as e:
-            log.error(f"Request timed out or other unexpected error: {e}")
-            error = True
+            with metrics.timed("audio_url"):
+                audio_request_content = urllib.request.urlopen(
+                    audio_request, timeout=30).read()
             break
-
-    if not error:
-        return audio_files
-    else:
-        log.error("Error processing audio url, aborting audio scrape...")
-        return []
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                limiter.backoff("HTTP 429", httpclient.get_retry_after(e))
+                if attempt < httpclient.TOO_MANY_REQUESTS_RETRIES:
+                    continue
+                raise
+            if is_challenge(e.read()):
+                limiter.backoff("a challenge page")
+                raise AudioAuthError(f"Challenge page from {api_url}")
+            if e.code in (401, 403):
+                raise AudioAuthError(f"HTTP {e.code} from {api_url}")
+            if e.code >= 500:
+                limiter.backoff(f"HTTP {e.code}")
+            raise
+    if audio_request_content[:2] == GZIP_MAGIC:
+        audio_request_content = gzip.decompress(audio_request_content)
+    if is_challenge(audio_request_content):
+        limiter.backoff("a challenge page")
+        raise AudioAuthError(f"Challenge page from {api_url}")
+    limiter.success(time.monotonic() - start)
+    audio_request_json = json.loads(audio_request_content.decode("utf-8"))
+    audio_url = audio_request_json["url"]
+    return download_book_chapter_audio(
+        book_json, chapter_json["order_no"], audio_url
+    )
 
 
 def download_book_chapter_audio(book_json, chapter_no, audio_url):
     filepath = get_book_pretty_filepath(book_json)
     filename = str(chapter_no) + ".m4a"
     audio_file = os.path.join(filepath, filename)
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
+    # the chapters of a book are downloaded by several threads at once
+    os.makedirs(filepath, exist_ok=True)
     if not os.path.exists(audio_file):
         log.info(
             f"Downloading audio file for blink {chapter_no} of "
             f"{book_json['slug']}..."
         )
-        download_request = requests.get(audio_url)
-        with open(audio_file, "wb") as outfile:
-            outfile.write(download_request.content)
+        start = time.perf_counter()
+        download_file(audio_url, audio_file)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(audio_file)
+        metrics.observe("audio_download", elapsed)
+        metrics.count("audio_download_bytes", size)
+        log.debug(
+            f"Downloaded {size / 1024:.0f} KB in {elapsed:.2f}s "
+            f"({size / 1024 / max(elapsed, 0.001):.0f} KB/s)")
     else:
         log.debug(
             f"Audio for blink {chapter_no} already downloaded, "
             "skipping...")
     return audio_file
 
-
-def download_book_cover_image(
-    book_json, filename="_cover.jpg", size="640", type="1_1",
-    alt_file="cover.jpg"
-):
-    """
-    Downloads the cover image specified in 'book_json'.
-
-    book_json -- dictionary object with book metadata.
-    filename -- filename of the output files
-    size -- the width of the image in pixels.
-            The 'sizes' options (generally) are: 130, 250, 470, 640, 1080,
-            and 1400.
-    type -- the aspect ratio of for the cover image.
-            The 'types' options (generally) are: '1_1', '2-2_1', and '3_4'.
-    alt_file -- an identical file to the expected image, but with a
-    different name.
-
-    The default 'image_url' (used by the HTML output) is type: '3_4',
-    size: 640.
-    """
-
-    # default cover image:
-    # cover_img_url = book_json["image_url"]
-
-    # variable size/resolution: (default is 640*640 px)
-    cover_img_url_tmplt = book_json["images"]["url_template"]
-    cover_img_url = cover_img_url_tmplt.replace(
-        "%type%", type).replace("%size%", size)
-
-    filepath = get_book_pretty_filepath(book_json)
-    cover_img_file = os.path.join(filepath, filename)
-    cover_img_alt_file = os.path.join(filepath, alt_file)
-    if not os.path.exists(filepath):
-        os.makedirs(filepath)
-    if not os.path.exists(cover_img_file):
-        # check if we have the "alternative" image file avaible
-        if not os.path.exists(cover_img_alt_file):
-            # download the image
-            log.info(f'Downloading "{cover_img_url}" as "{filename}"')
-            download_request = requests.get(cover_img_url)
-            with open(cover_img_file, "wb") as outfile:
-                outfile.write(download_request.content)
-        else:
-            # copy the image file
-            log.debug(f"Copying {alt_file} as {filename}")
-            copy_file(cover_img_alt_file, cover_img_file)
-    else:
-        log.debug(f"{filename} already exists, skipping...")
-    return cover_img_file
-
@@ -0,0 +1,137 @@
+import os
+import glob
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import httpclient
+import logger
+from utils import atomic_open
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+SITEMAP_PATH = "/en/sitemap"
+SNAPSHOTS_DIR = "snapshots"
+
+# the section of the sitemap listing the books
+BOOKS_SECTION_CLASSES = {"sitemap__section", "sitemap__section--books"}
+
+
+class SitemapBooksParser(HTMLParser):
+    """
+    Collects the links in the books section of the sitemap page, as the
+    page is fed to it chunk by chunk.
+    """
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.links = []
+        # tag name and nesting depth of the books section we're in, if any
+        self.section_tag = None
+        self.section_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.section_tag:
+            if tag == self.section_tag:
+                self.section_depth += 1
+            elif tag == "a" and attrs.get("href"):
+                self.links.append(urljoin(self.base_url, attrs["href"]))
+        elif BOOKS_SECTION_CLASSES.issubset(
+            (attrs.get("class") or "").split()
+        ):
+            self.section_tag = tag
+            self.section_depth = 1
+
+    def handle_endtag(self, tag):
+        if self.section_tag and tag == self.section_tag:
+            self.section_depth -= 1
+            if not self.section_depth:
+                self.section_tag = None
+
+
+def fetch_books(url=None):
+    # stream the sitemap page through the parser, without keeping it whole
+    url = url or httpclient.get_site_url(SITEMAP_PATH)
+    parser = SitemapBooksParser(url)
+    with httpclient.get(url, stream=True) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or "utf-8"
+        for chunk in response.iter_content(
+            chunk_size=64 * 1024, decode_unicode=True
+        ):
+            parser.feed(chunk)
+    parser.close()
+    return parser.links
+
+
+def get_snapshot_filename(day=None):
+    day = day or time.strftime("%Y-%m-%d")
+    return os.path.join(SNAPSHOTS_DIR, f"sitemap-{day}.txt")
+
+
+def read_last_snapshot():
+    # returns the date and links of the most recent snapshot, if any
+    snapshots = sorted(
+        glob.glob(os.path.join(SNAPSHOTS_DIR, "sitemap-*.txt")))
+    if not snapshots:
+        return None, []
+    last_snapshot = snapshots[-1]
+    with open(last_snapshot, encoding="utf-8") as f:
+        links = [line.strip() for line in f if line.strip()]
+    day = os.path.basename(last_snapshot)[len("sitemap-"):-len(".txt")]
+    return day, links
+
+
+def save_snapshot(links):
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    snapshot = get_snapshot_filename()
+    with atomic_open(snapshot) as outfile:
+        for link in links:
+            outfile.write(link + "\n")
+    return snapshot
+
+
+def diff_snapshot(links):
+    """
+    Compares 'links' with the last snapshot, returning the links added and
+    removed since then (or None if there is no previous snapshot).
+    """
+    day, last_links = read_last_snapshot()
+    if day is None:
+        return None
+    current, previous = set(links), set(last_links)
+    added = [link for link in links if link not in previous]
+    removed = [link for link in last_links if link not in current]
+    log.info(
+        f"{len(added)} book{'s' if len(added) != 1 else ''} added and "
+        f"{len(removed)} removed from the sitemap since {day}"
+    )
+    for link in added:
+        log.debug(f"Added: {link}")
+    for link in removed:
+        log.debug(f"Removed: {link}")
+    return added, removed
+
+
+def record_books(links, match_language=""):
+    """
+    Diffs the book 'links' of the sitemap with the last snapshot, and stores
+    them as today's snapshot. The snapshot keeps every language, the links
+    returned are filtered by 'match_language'.
+    """
+    diff_snapshot(links)
+    save_snapshot(links)
+    if match_language:
+        links = [link for link in links if link.endswith(match_language)]
+    return links
+
+
+def get_all_books(match_language=""):
+    # fetches every book link from the sitemap over plain HTTP (see
+    # record_books)
+    links = fetch_books()
+    if not links:
+        return []
+    return record_books(links, match_language)
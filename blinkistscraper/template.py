@@ -0,0 +1,77 @@
+import os
+import re
+import hashlib
+import threading
+
+# a template placeholder, e.g. {title} or {__chapters__}
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class Template:
+    """
+    A template parsed once into its literal text segments and the
+    placeholders between them, so it can be rendered in a single pass.
+
+    Placeholders without a matching value are left untouched, e.g. a
+    {who_should_read} placeholder is kept as-is for a book without such key.
+    """
+
+    def __init__(self, text):
+        # re.split with a capturing group alternates literals and keys,
+        # starting and ending with a (possibly empty) literal
+        parts = PLACEHOLDER.split(text)
+        self.literals = parts[0::2]
+        self.keys = parts[1::2]
+
+    def has(self, key):
+        return key in self.keys
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            if key in values:
+                parts.append(values[key])
+            else:
+                parts.append(f"{{{key}}}")
+            parts.append(literal)
+        return "".join(parts)
+
+
+def get_template_filename(name):
+    return os.path.join(os.getcwd(), "templates", name)
+
+
+def load(name, kind="template"):
+    # read (and parse, or hash) the file in the templates folder once,
+    # reloading it only when it is modified
+    filename = get_template_filename(name)
+    mtime = os.stat(filename).st_mtime_ns
+    key = (filename, kind)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(filename, "r", encoding="utf-8") as f:
+        content = f.read()
+    if kind == "template":
+        content = Template(content)
+    elif kind == "hash":
+        content = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        _cache[key] = (mtime, content)
+    return content
+
+
+def get_template(name):
+    return load(name, kind="template")
+
+
+def get_text(name):
+    return load(name, kind="text")
+
+
+def get_hash(name):
+    return load(name, kind="hash")
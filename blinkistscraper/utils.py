@@ -1,26 +1,40 @@
 import os
-import json
 import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
 from shutil import which
+from urllib.parse import urlsplit
+
+import dumps
 
 
 def get_or_read_json(book_json_or_file):
     if type(book_json_or_file) is dict:
         return book_json_or_file
     else:
-        with open(book_json_or_file) as f:
-            return json.load(f)
+        # dumps may be stored compressed, see the dumps module
+        return dumps.read(book_json_or_file)
 
 
 def sanitize_name(name):
     return re.sub(r'[\\/*?:"<>|.]', "", name).strip()
 
 
+def get_book_slug(book_json_or_url):
+    if isinstance(book_json_or_url, dict):
+        return book_json_or_url["slug"]
+    # every form of a book url (/books/ or /nc/reader/, any language prefix,
+    # surrounding whitespace, trailing slash or query string) maps to the
+    # book's slug, which is what identifies a book
+    path = urlsplit(book_json_or_url.strip()).path.rstrip("/")
+    return path.split("/")[-1]
+
+
 def get_book_dump_filename(book_json_or_url):
-    if "blinkist.com" in book_json_or_url:
-        return os.path.join("dump", book_json_or_url.split("/")[-1] + ".json")
-    else:
-        return os.path.join("dump", book_json_or_url["slug"] + ".json")
+    return os.path.join(
+        "dump", get_book_slug(book_json_or_url) + dumps.get_extension())
 
 
 def get_book_pretty_filepath(book_json):
@@ -41,3 +55,67 @@ def get_book_pretty_filename(book_json, extension=""):
 
 def is_installed(tool):
     return which(tool)
+
+
+def get_tmp_filename(filename):
+    # unique to the process and thread, so that concurrent writers of the
+    # same file never share their temporary file
+    return f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+@contextmanager
+def replacing(filename):
+    """
+    Yields a temporary filename to write to instead of 'filename', which it
+    replaces once the block completes, or is removed if the block fails: an
+    existing 'filename' is never a partial file.
+    """
+    tmp_file = get_tmp_filename(filename)
+    try:
+        yield tmp_file
+        os.replace(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+@contextmanager
+def atomic_open(filename, mode="w"):
+    # like open, for writing 'filename' in one go (see replacing)
+    encoding = None if "b" in mode else "utf-8"
+    with replacing(filename) as tmp_file:
+        with open(tmp_file, mode, encoding=encoding) as outfile:
+            yield outfile
+
+
+def get_hashed_filename(directory, key, extension=".json"):
+    # cached files are stored under the hash of their key
+    return os.path.join(
+        directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + extension)
+
+
+def read_cached(directory, key):
+    """
+    Returns the json object cached under 'key' in 'directory' (see
+    write_cached), or None if there is none.
+    """
+    cache_file = get_hashed_filename(directory, key)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # guard against hash collisions
+    if cached.get("key") != key:
+        return None
+    return cached
+
+
+def write_cached(directory, key, cached):
+    # caches the json object 'cached' under 'key' in 'directory'
+    os.makedirs(directory, exist_ok=True)
+    with atomic_open(get_hashed_filename(directory, key)) as outfile:
+        json.dump(dict(cached, key=key), outfile)
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+import logger
+
+log = logger.get(f"blinkistscraper.{__name__}")
+
+
+class DriverPool:
+    """
+    A pool of logged-in webdrivers, each one owned by its own worker thread.
+
+    Selenium drivers are not thread-safe, so books are never handed to a
+    specific driver: they are put on a shared queue and picked up by
+    whichever worker is free.
+
+    create_driver -- callable returning a new, logged-in driver (or None if
+                     the driver could not log in).
+    scrape -- callable(driver, book_url, category) scraping a single book.
+
+    The workers don't wait between books: the requests of every driver go
+    through the same adaptive rate limiter of the website's host.
+    """
+
+    def __init__(self, create_driver, scrape):
+        self.create_driver = create_driver
+        self.scrape = scrape
+        self.books = queue.Queue()
+        self.threads = []
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def start(self, count):
+        # drivers are created (and logged in) from within their own threads,
+        # so that starting several browsers happens in parallel
+        for _ in range(count):
+            self._spawn(None)
+
+    def adopt(self, driver):
+        # add an already initialized driver to the pool as a new worker
+        self._spawn(driver)
+
+    def submit(self, book_url, category):
+        self.books.put((book_url, category))
+
+    def join(self, keep=None):
+        # one sentinel per worker, queued after all the submitted books. the
+        # drivers are closed once done, except for 'keep'
+        for _ in self.threads:
+            self.books.put(None)
+        for thread in self.threads:
+            thread.join()
+        for driver in self.drivers:
+            if driver is keep:
+                continue
+            try:
+                driver.quit()
+            except Exception as e:
+                log.debug(f"Error closing driver: {e}")
+
+    def _spawn(self, driver):
+        worker_id = len(self.threads) + 1
+        thread = threading.Thread(
+            target=self._work, args=(worker_id, driver), daemon=True,
+            name=f"worker-{worker_id}"
+        )
+        self.threads.append(thread)
+        thread.start()
+
+    def _work(self, worker_id, driver):
+        if not driver:
+            try:
+                driver = self.create_driver()
+            except Exception as e:
+                log.error(f"Worker {worker_id} failed to start a driver: {e}")
+                driver = None
+            if not driver:
+                log.error(
+                    f"Worker {worker_id} could not log in, leaving the "
+                    "remaining books to the other workers")
+                return
+        with self.lock:
+            self.drivers.append(driver)
+        log.debug(f"Worker {worker_id} ready")
+
+        while True:
+            job = self.books.get()
+            if job is None:
+                break
+            book_url, category = job
+            try:
+                self.scrape(driver, book_url, category)
+            except Exception as e:
+                log.exception(e)
+                log.error(f"Worker {worker_id} failed scraping {book_url}")
+        log.debug(f"Worker {worker_id} done")